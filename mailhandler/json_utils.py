@@ -0,0 +1,42 @@
+"""
+MailLLM - JSON-Hilfsfunktionen
+Gemeinsame (De-)Serialisierung für alle Module: orjson, falls verfügbar, sonst json
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Union
+
+# Schneller JSON-Encoder/-Parser (optional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _json_default(obj: Any) -> Any:
+    """Serialisiert datetime wie orjson (ISO 8601), andere unbekannte Typen werden abgelehnt"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps_json(data: Any, pretty: bool = False) -> bytes:
+    """Serialisiert Daten als kompaktes (pretty: mit 2 Leerzeichen eingerücktes) UTF-8-JSON
+    
+    Beide Varianten liefern dieselbe Ausgabe: Umlaute bleiben unmaskiert, datetime-Werte
+    werden als ISO-8601-String geschrieben.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else None)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2, default=_json_default).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+
+def loads_json(content: Union[bytes, str]) -> Any:
+    """Parst JSON aus bytes oder str"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(content)
+    return json.loads(content)
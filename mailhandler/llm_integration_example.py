@@ -4,9 +4,13 @@ MailLLM - LLM-Integrationsbeispiel
 Zeigt, wie heruntergeladene E-Mails mit einem LLM verwendet werden können
 """
 
-import json
+import asyncio
+import math
 import os
-from typing import List, Dict, Any
+import time
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from json_utils import dumps_json
 from mail_search import MailSearch
 
 # Beispiel für OpenAI Integration (optional)
@@ -17,6 +21,86 @@ except ImportError:
     OPENAI_AVAILABLE = False
     print("Hinweis: OpenAI-Bibliothek nicht installiert. Installiere mit: pip install openai")
 
+# Lokale Embeddings für den Vector-Export (optional)
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+
+# Gemeinsame Parameter für alle Chat-Anfragen
+_CHAT_OPTIONS = {
+    'model': "gpt-3.5-turbo",
+    'max_tokens': 1000,
+    'temperature': 0.7
+}
+
+# Embedding-Modell für den semantischen Antwort-Cache
+_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Lokales Modell für vorberechnete Embeddings im Vector-Export
+_LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+
+class SemanticCache:
+    """LRU-Cache für LLM-Antworten, der inhaltlich ähnliche Fragen über Embeddings erkennt
+    
+    Eine gecachte Antwort wird zurückgegeben, wenn die Kosinus-Ähnlichkeit der Fragen
+    mindestens threshold (Standard 0.86) beträgt und der Eintrag jünger als ttl Sekunden
+    (Standard 300) ist. Unterschiedliche Fragen oberhalb der Schwelle erhalten dabei
+    dieselbe Antwort - die Schwelle also nicht zu niedrig wählen.
+    """
+    
+    def __init__(self, threshold: float = 0.86, ttl: float = 300.0, max_size: int = 256):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        # Schlüssel -> (normiertes Embedding, Kontext-Schlüssel, Antwort, Zeitstempel)
+        self._entries: "OrderedDict[int, Tuple[List[float], Any, str, float]]" = OrderedDict()
+        self._next_key = 0
+    
+    @staticmethod
+    def normalize(embedding: List[float]) -> List[float]:
+        """Normiert ein Embedding auf Länge 1 (Skalarprodukt = Kosinus-Ähnlichkeit)"""
+        norm = math.sqrt(sum(x * x for x in embedding))
+        return [x / norm for x in embedding] if norm else embedding
+    
+    def _evict_expired(self, now: float):
+        """Entfernt abgelaufene Einträge"""
+        expired = [key for key, entry in self._entries.items() if now - entry[3] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+    
+    def lookup(self, embedding: List[float], context_key: Any = None) -> Optional[str]:
+        """Liefert die Antwort der ähnlichsten gecachten Frage oder None"""
+        self._evict_expired(time.time())
+        
+        best_key, best_score = None, self.threshold
+        for key, (cached_embedding, cached_context, _, _) in self._entries.items():
+            if cached_context != context_key:
+                continue
+            score = sum(a * b for a, b in zip(embedding, cached_embedding))
+            if score >= best_score:
+                best_key, best_score = key, score
+        
+        if best_key is None:
+            return None
+        
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key][2]
+    
+    def store(self, embedding: List[float], answer: str, context_key: Any = None):
+        """Speichert eine Antwort und verdrängt bei Bedarf den am längsten ungenutzten Eintrag"""
+        self._entries[self._next_key] = (embedding, context_key, answer, time.time())
+        self._next_key += 1
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Leert den Cache"""
+        self._entries.clear()
+
 
 class LLMIntegration:
     """Beispiel-Klasse für LLM-Integration mit E-Mails"""
@@ -30,10 +114,18 @@ class LLMIntegration:
             self.openai_client = openai.OpenAI(
                 api_key=os.getenv('OPENAI_API_KEY')
             )
+        
+        # Cache für Antworten auf (inhaltlich) bereits gestellte Fragen
+        self.answer_cache = SemanticCache()
+        
+        # Lokales Embedding-Modell (wird erst beim ersten Export mit Embeddings geladen)
+        self._embedding_model = None
     
     def load_emails(self):
         """Lädt alle E-Mails in den Index"""
         self.mail_index = self.mail_search.load_mail_index()
+        # Neuer Index -> gecachte Antworten können veraltet sein
+        self.answer_cache.clear()
         print(f"📧 {len(self.mail_index)} E-Mails geladen")
     
     def create_context_from_emails(self, query: str, max_emails: int = 5) -> str:
@@ -44,23 +136,21 @@ class LLMIntegration:
         if not relevant_emails:
             return "Keine relevanten E-Mails gefunden."
         
-        # Kontext erstellen
-        context = f"Basierend auf {len(relevant_emails)} relevanten E-Mails:\n\n"
-        
-        for i, email in enumerate(relevant_emails, 1):
-            context += f"E-Mail {i}:\n"
-            context += f"Datum: {email['received_date'].strftime('%Y-%m-%d %H:%M')}\n"
-            context += f"Von: {email['from']}\n"
-            context += f"Betreff: {email['subject']}\n"
-            context += f"Inhalt: {email['body'][:500]}...\n\n"
+        # Kontext erstellen (Teile sammeln und einmal zusammenfügen)
+        parts = [f"Basierend auf {len(relevant_emails)} relevanten E-Mails:\n\n"]
+        parts.extend(
+            f"E-Mail {i}:\n"
+            f"Datum: {email['received_date'].strftime('%Y-%m-%d %H:%M')}\n"
+            f"Von: {email['from']}\n"
+            f"Betreff: {email['subject']}\n"
+            f"Inhalt: {email['body_preview']}...\n\n"
+            for i, email in enumerate(relevant_emails, 1)
+        )
         
-        return context
+        return "".join(parts)
     
-    def ask_llm_about_emails(self, question: str, max_context_emails: int = 5) -> str:
-        """Stellt eine Frage an das LLM basierend auf den E-Mails"""
-        if not OPENAI_AVAILABLE:
-            return "OpenAI-Bibliothek nicht verfügbar. Installiere mit: pip install openai"
-        
+    def _build_llm_messages(self, question: str, max_context_emails: int) -> List[Dict[str, str]]:
+        """Erstellt die Chat-Nachrichten (inkl. E-Mail-Kontext) für eine Frage"""
         # Kontext aus relevanten E-Mails erstellen
         context = self.create_context_from_emails(question, max_context_emails)
         
@@ -75,21 +165,89 @@ Frage: {question}
 Antworte basierend auf den bereitgestellten E-Mail-Informationen. 
 Falls die Informationen nicht ausreichen, gib das an."""
 
+        return [
+            {"role": "system", "content": "Du bist ein hilfreicher Assistent für E-Mail-Analyse."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _embed_question(self, question: str) -> Optional[List[float]]:
+        """Berechnet das normierte Embedding einer Frage (None bei Fehlern)"""
+        try:
+            response = self.openai_client.embeddings.create(
+                model=_EMBEDDING_MODEL,
+                input=question
+            )
+            return SemanticCache.normalize(response.data[0].embedding)
+        except Exception:
+            return None
+    
+    def ask_llm_about_emails(self, question: str, max_context_emails: int = 5,
+                             use_cache: bool = False) -> str:
+        """Stellt eine Frage an das LLM basierend auf den E-Mails
+        
+        Mit use_cache werden Antworten im semantischen Cache (self.answer_cache) abgelegt
+        und für ähnliche Fragen wiederverwendet (Kosinus-Ähnlichkeit >= 0.86, gültig für
+        300 Sekunden; siehe SemanticCache). Jede nicht gecachte Frage kostet dann einen
+        zusätzlichen Embedding-Aufruf, und eine andere, aber sehr ähnlich formulierte Frage
+        kann die gecachte Antwort erhalten. Daher standardmäßig deaktiviert.
+        """
+        if not OPENAI_AVAILABLE:
+            return "OpenAI-Bibliothek nicht verfügbar. Installiere mit: pip install openai"
+        
+        # Ähnliche Frage schon beantwortet? Dann ohne LLM-Aufruf antworten
+        question_embedding = self._embed_question(question) if use_cache else None
+        if question_embedding is not None:
+            cached_answer = self.answer_cache.lookup(question_embedding, max_context_emails)
+            if cached_answer is not None:
+                return cached_answer
+        
+        messages = self._build_llm_messages(question, max_context_emails)
+        
         try:
             response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Du bist ein hilfreicher Assistent für E-Mail-Analyse."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7
+                messages=messages,
+                **_CHAT_OPTIONS
             )
             
-            return response.choices[0].message.content
+            answer = response.choices[0].message.content
             
         except Exception as e:
             return f"Fehler bei der LLM-Anfrage: {e}"
+        
+        if question_embedding is not None:
+            self.answer_cache.store(question_embedding, answer, max_context_emails)
+        
+        return answer
+    
+    def ask_llm_about_emails_batch(self, questions: List[str], max_context_emails: int = 5,
+                                   max_concurrency: int = 8) -> List[str]:
+        """Stellt mehrere Fragen parallel an das LLM (Antworten in derselben Reihenfolge)"""
+        if not OPENAI_AVAILABLE:
+            return ["OpenAI-Bibliothek nicht verfügbar. Installiere mit: pip install openai"] * len(questions)
+        
+        # Kontext vorab erstellen, die Anfragen selbst laufen danach nebenläufig
+        messages_list = [self._build_llm_messages(question, max_context_emails) for question in questions]
+        
+        return asyncio.run(self._ask_llm_batch_async(messages_list, max_concurrency))
+    
+    async def _ask_llm_batch_async(self, messages_list: List[List[Dict[str, str]]],
+                                   max_concurrency: int) -> List[str]:
+        """Führt die Chat-Anfragen über einen gemeinsamen AsyncOpenAI-Client aus"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async with openai.AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY')) as client:
+            async def ask(messages: List[Dict[str, str]]) -> str:
+                async with semaphore:
+                    try:
+                        response = await client.chat.completions.create(
+                            messages=messages,
+                            **_CHAT_OPTIONS
+                        )
+                        return response.choices[0].message.content
+                    except Exception as e:
+                        return f"Fehler bei der LLM-Anfrage: {e}"
+            
+            return await asyncio.gather(*(ask(messages) for messages in messages_list))
     
     def create_email_summary(self, date_range_days: int = 7) -> str:
         """Erstellt eine Zusammenfassung der E-Mails der letzten Tage"""
@@ -103,57 +261,105 @@ Falls die Informationen nicht ausreichen, gib das an."""
         if not recent_emails:
             return f"Keine E-Mails in den letzten {date_range_days} Tagen gefunden."
         
-        summary = f"E-Mail-Zusammenfassung der letzten {date_range_days} Tage:\n\n"
-        summary += f"Anzahl E-Mails: {len(recent_emails)}\n"
+        parts = [
+            f"E-Mail-Zusammenfassung der letzten {date_range_days} Tage:\n\n",
+            f"Anzahl E-Mails: {len(recent_emails)}\n"
+        ]
         
         # Nach Absendern gruppieren
-        senders = {}
-        for email in recent_emails:
-            sender = email['from']
-            senders[sender] = senders.get(sender, 0) + 1
+        senders = Counter(email['from'] for email in recent_emails)
         
-        summary += "\nE-Mails nach Absendern:\n"
-        for sender, count in sorted(senders.items(), key=lambda x: x[1], reverse=True):
-            summary += f"  {sender}: {count} E-Mails\n"
+        parts.append("\nE-Mails nach Absendern:\n")
+        parts.extend(
+            f"  {sender}: {count} E-Mails\n"
+            for sender, count in senders.most_common()
+        )
         
         # Wichtigste Themen (basierend auf Betreffzeilen)
-        subjects = [email['subject'] for email in recent_emails]
-        summary += f"\nAnzahl verschiedene Betreffzeilen: {len(set(subjects))}\n"
+        unique_subjects = len({email['subject'] for email in recent_emails})
+        parts.append(f"\nAnzahl verschiedene Betreffzeilen: {unique_subjects}\n")
         
-        return summary
+        return "".join(parts)
+    
+    def _get_embedding_model(self):
+        """Lädt das lokale Embedding-Modell einmalig"""
+        if self._embedding_model is None:
+            self._embedding_model = SentenceTransformer(_LOCAL_EMBEDDING_MODEL)
+        return self._embedding_model
+    
+    def _write_vector_entries(self, f, entries: List[Dict[str, Any]], batch_size: int,
+                              quantize: bool = False):
+        """Berechnet die Embeddings eines Stapels in einem Aufruf und schreibt die Einträge"""
+        embeddings = self._get_embedding_model().encode(
+            [entry['text'] for entry in entries],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        for entry, embedding in zip(entries, embeddings):
+            if quantize:
+                # Int8-Skalarquantisierung mit Skalierungsfaktor pro Datensatz:
+                # vector ≈ vector_int8 * scale
+                scale = float(abs(embedding).max()) / 127 or 1.0
+                entry['vector_int8'] = (embedding / scale).round().astype('int8').tolist()
+                entry['scale'] = scale
+            else:
+                entry['vector'] = embedding.tolist()
+            f.write(dumps_json(entry) + b'\n')
     
-    def export_for_vector_database(self, output_file: str = "emails_for_vector_db.json") -> str:
-        """Exportiert E-Mails in einem Format für Vector-Datenbanken"""
+    def export_for_vector_database(self, output_file: str = "emails_for_vector_db.jsonl",
+                                   include_embeddings: bool = False,
+                                   embedding_batch_size: int = 64,
+                                   quantize_embeddings: bool = False) -> str:
+        """Exportiert E-Mails als JSON Lines (ein Datensatz pro Zeile) für Vector-Datenbanken
+        
+        Mit include_embeddings werden die Embeddings lokal (sentence-transformers) in
+        Stapeln vorberechnet und als 'vector' mitgeschrieben. Mit quantize_embeddings
+        werden sie stattdessen als 'vector_int8' plus 'scale' gespeichert (4x kleiner).
+        """
         if not self.mail_index:
             self.load_emails()
         
-        vector_data = []
+        if include_embeddings and not SENTENCE_TRANSFORMERS_AVAILABLE:
+            print("Hinweis: sentence-transformers nicht installiert, Export ohne Embeddings. "
+                  "Installiere mit: pip install sentence-transformers")
+            include_embeddings = False
         
-        for email in self.mail_index:
-            # Text für Embeddings vorbereiten
-            text_for_embedding = f"""
+        # Einträge einzeln in die Datei streamen, statt erst eine komplette Liste aufzubauen
+        # (mit Embeddings wird jeweils ein Stapel gesammelt und gemeinsam kodiert)
+        pending = []
+        with open(output_file, 'wb') as f:
+            for email in self.mail_index:
+                # Text für Embeddings vorbereiten
+                text_for_embedding = f"""
             Betreff: {email['subject']}
             Von: {email['from']}
             Datum: {email['received_date'].strftime('%Y-%m-%d %H:%M')}
             Inhalt: {email['body']}
             """.strip()
             
-            vector_entry = {
-                'id': email['filename'],
-                'text': text_for_embedding,
-                'metadata': {
-                    'date': email['received_date'].isoformat(),
-                    'from': email['from'],
-                    'subject': email['subject'],
-                    'word_count': email['word_count'],
-                    'filepath': email['filepath']
+                vector_entry = {
+                    'id': email['filename'],
+                    'text': text_for_embedding,
+                    'metadata': {
+                        'date': email['received_date'],
+                        'from': email['from'],
+                        'subject': email['subject'],
+                        'word_count': email['word_count'],
+                        'filepath': email['filepath']
+                    }
                 }
-            }
-            vector_data.append(vector_entry)
-        
-        # Als JSON speichern
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(vector_data, f, ensure_ascii=False, indent=2)
+                
+                if include_embeddings:
+                    pending.append(vector_entry)
+                    if len(pending) >= embedding_batch_size:
+                        self._write_vector_entries(f, pending, embedding_batch_size, quantize_embeddings)
+                        pending = []
+                else:
+                    f.write(dumps_json(vector_entry) + b'\n')
+            
+            if pending:
+                self._write_vector_entries(f, pending, embedding_batch_size, quantize_embeddings)
         
         print(f"✅ Vector-Datenbank-Export erstellt: {output_file}")
         return output_file
@@ -203,7 +409,7 @@ def main():
     print("\n✅ Beispiel abgeschlossen!")
     print("\nNächste Schritte:")
     print("1. Setze OPENAI_API_KEY in .env für LLM-Funktionen")
-    print("2. Verwende die exportierten JSON-Dateien mit Vector-Datenbanken")
+    print("2. Verwende die exportierten JSON-Lines-Dateien mit Vector-Datenbanken")
     print("3. Integriere in deine eigene LLM-Anwendung")
 
 
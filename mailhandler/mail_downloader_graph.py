@@ -6,18 +6,30 @@ Verwendet OAuth2 und Microsoft Graph API für moderne M365-Konten
 
 import os
 import re
+import html
 import sys
 import json
-from datetime import datetime, timedelta
+import base64
+import hashlib
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 import logging
+import logging.handlers
+import atexit
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 from dotenv import load_dotenv
 from tqdm import tqdm
 import html2text
 import requests
+from requests.adapters import HTTPAdapter
+
+from json_utils import loads_json
 
 # OAuth2-Bibliotheken
 try:
@@ -27,18 +39,79 @@ except ImportError:
     OAUTH2_AVAILABLE = False
     print("Warnung: msal nicht verfügbar. Installiere mit: pip install msal")
 
-# Logging konfigurieren
+# Schneller HTML-Parser (optional, sonst html2text); Lexbor-Backend, da das ältere
+# Modest-Backend (selectolax.parser) ab selectolax 1.0 entfernt ist
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    SELECTOLAX_AVAILABLE = True
+except ImportError:
+    SELECTOLAX_AVAILABLE = False
+
+# Logging konfigurieren: Die Worker-Threads legen Log-Einträge nur in eine Queue,
+# Datei- und Konsolenausgabe übernimmt ein eigener Listener-Thread
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    logging.FileHandler('mail_downloader.log'),
+    logging.StreamHandler(sys.stdout)
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('mail_downloader.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 
+# Maximale Seitengröße ($top) für Nachrichtenabfragen in Microsoft Graph
+_GRAPH_MAX_PAGE_SIZE = 1000
+
+# Wiederholungen bei Drosselung (HTTP 429) bzw. kurzzeitiger Überlastung (HTTP 503)
+_GRAPH_MAX_RETRIES = 5
+_GRAPH_RETRY_STATUS = frozenset({429, 503})
+
+# Maximale Anzahl Teilanfragen pro $batch-Anfrage
+_GRAPH_BATCH_LIMIT = 20
+
+# Download in zwei Schritten: die Liste enthält nur die Metadaten für Dateiname und Abgleich,
+# Body und Anhänge werden anschließend nur für noch nicht gespeicherte E-Mails geladen
+# (Anhänge nur mit Metadaten, PDF-Inhalte werden über /$value geladen)
+_GRAPH_MESSAGE_LIST_SELECT = 'id,subject,from,toRecipients,receivedDateTime'
+_GRAPH_MESSAGE_DETAIL_SELECT = 'body,bodyPreview'
+# Nur Felder des Basistyps attachment: ohne $select liefert Graph contentBytes aller Anhänge
+# (auch Bilder) inline; contentBytes selbst gehört nur zu microsoft.graph.fileAttachment,
+# ein $select darauf lehnt Graph mit 400 ab
+_GRAPH_ATTACHMENT_EXPAND = 'attachments($select=id,name,contentType,size)'
+
+# Ordner, die beim Durchsuchen aller Ordner übersprungen werden (Kleinschreibung)
+_SKIPPED_FOLDERS = frozenset({'inbox', 'archive', 'sent items', 'deleted items', 'drafts'})
+
+# Ab Python 3.11 versteht datetime.fromisoformat das 'Z'-Suffix von Graph direkt
+_FROMISOFORMAT_PARSES_Z = sys.version_info >= (3, 11)
+
+# Übersetzungstabelle für ungültige Dateinamen-Zeichen
+_INVALID_FN_TABLE = str.maketrans({char: '_' for char in '<>:"/\\|?*'})
+
+# Vorkompilierte Regex-Muster für den Pfad pro E-Mail
+_MULTI_UNDERSCORE = re.compile(r'_+')
+_HTML_TAG = re.compile(r'<[^>]+>')
+
+
+class MessageDetailsError(RuntimeError):
+    """Für keine der neuen E-Mails konnten Body und Anhänge geladen werden"""
+
+
+class _MailHTML2Text(html2text.HTML2Text):
+    """HTML2Text mit fest eingestellten Optionen für E-Mails (Links/Bilder erhalten, kein Umbruch)"""
+    
+    def __init__(self):
+        super().__init__(bodywidth=0)
+        self.ignore_links = False
+        self.ignore_images = False
+
+
 class MailDownloaderGraph:
     """Hauptklasse für den E-Mail-Download mit Microsoft Graph API"""
     
@@ -60,29 +133,89 @@ class MailDownloaderGraph:
         self.include_archive = os.getenv('INCLUDE_ARCHIVE', 'true').lower() == 'true'
         
         # Chunk-basiertes Laden
-        self.chunk_size = int(os.getenv('CHUNK_SIZE', '50'))
+        # (größere Chunks = weniger Round-Trips; Graph liefert höchstens 1000 Nachrichten pro Seite)
+        self.chunk_size = min(int(os.getenv('CHUNK_SIZE', str(_GRAPH_MAX_PAGE_SIZE))), _GRAPH_MAX_PAGE_SIZE)
         self.load_all_emails = os.getenv('LOAD_ALL_EMAILS', 'true').lower() == 'true'
         self.max_emails_per_folder = int(os.getenv('MAX_EMAILS_PER_FOLDER', '0'))  # 0 = unbegrenzt
         
+        # Body serverseitig als Text anfordern (kleinere Antworten, keine lokale HTML-Konvertierung)
+        self.prefer_text_body = os.getenv('PREFER_TEXT_BODY', 'false').lower() == 'true'
+        
+        # Inkrementeller Abgleich: pro Ordner nur E-Mails seit dem letzten Lauf laden.
+        # Standardmäßig aus: Der Stand ist das Empfangsdatum der neuesten E-Mail, daher werden
+        # E-Mails, die nachträglich in einen Ordner verschoben werden (älteres Empfangsdatum),
+        # nicht mehr gefunden. Der vollständige Abgleich ist dank Metadaten-Liste und
+        # Überspringen bekannter IDs ohnehin günstig.
+        self.incremental_sync = os.getenv('INCREMENTAL_SYNC', 'false').lower() == 'true'
+        self.sync_state_file = self.mail_dir / '.sync_state.json'
+        
+        # Anzahl paralleler Worker für das Speichern der E-Mails (inkl. PDF-Download)
+        self.download_workers = max(1, int(os.getenv('DOWNLOAD_WORKERS', '8')))
+        # Ein gemeinsamer Pool für alle Ordner und Chunks (statt eines neuen Pools pro Chunk)
+        self._save_executor = ThreadPoolExecutor(max_workers=self.download_workers)
+        
+        # Anzahl der Ordner, die gleichzeitig geladen werden
+        self.folder_workers = max(1, int(os.getenv('FOLDER_WORKERS', '4')))
+        # Lädt pro Ordner die nächste Seite, während der aktuelle Chunk gespeichert wird
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=self.folder_workers)
+        
         # Graph API Endpoints
         self.graph_endpoint = "https://graph.microsoft.com/v1.0"
         
-        # HTML zu Text Konverter
-        self.html_converter = html2text.HTML2Text()
-        self.html_converter.ignore_links = False
-        self.html_converter.ignore_images = False
-        self.html_converter.body_width = 0
+        # Gemeinsame HTTP-Session: Keep-Alive statt neuer TLS-Verbindung pro Anfrage,
+        # Pool groß genug für alle gleichzeitig laufenden Ordner- und Speicher-Worker
+        pool_size = self.folder_workers + self.download_workers
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        self._session.headers['Content-Type'] = 'application/json'
+        
+        # HTML zu Text Konverter (einer pro Thread, HTML2Text ist nicht thread-safe)
+        self._thread_local = threading.local()
+        
+        # Schützt die ordnerübergreifende Deduplizierung der E-Mail-IDs
+        self._seen_lock = threading.Lock()
         
         # Deduplizierung für PDF-Attachments
         self.seen_pdf_attachment_ids = set()
+        self._pdf_lock = threading.Lock()
         
         # Verzeichnisse erstellen
         self.mail_dir.mkdir(exist_ok=True)
         self.pdf_dir.mkdir(exist_ok=True)
         
+        # Inhaltsbasierte PDF-Deduplizierung: SHA-256 -> Dateiname im PDF-Verzeichnis
+        # (identische PDFs aus weitergeleiteten E-Mails werden als Hardlink abgelegt)
+        self.pdf_dedup_index_file = self.pdf_dir / '.dedup-index.json'
+        self._pdf_hash_index = self._load_pdf_dedup_index()
+        self._pdf_hash_by_name = {name: digest for digest, name in self._pdf_hash_index.items()}
+        self._pdf_index_dirty = False
+        
+        # Bereits vorhandene E-Mail-Dateien (einmal einlesen, danach bei jedem Speichern ergänzen)
+        self._existing_files = self._scan_existing_files()
+        
+        # Bereits gespeicherte Nachrichten über Läufe hinweg: Graph-ID -> Dateiname
+        self.seen_ids_file = self.mail_dir / '.seen_ids.json'
+        self._saved_message_ids = self._load_saved_message_ids()
+        
+        # Stand des letzten Abgleichs pro Ordner
+        self._sync_state = self._load_sync_state()
+        
+        # Pro Lauf einmal bestimmt: Beginn des Zeitfensters und Ordnerliste (Name -> ID)
+        self._window_start = None
+        self._folders_cache = None
+        self._folder_id_cache = {}
+        self._folders_lock = threading.Lock()
+        
+        # Fehlgeschlagene Detail-Abfragen im aktuellen Lauf (Anzahl, erster Fehler)
+        self._detail_failures = 0
+        self._detail_first_error = None
+        self._detail_lock = threading.Lock()
+        
         # NEU: Token-Cache
         self._access_token = None
         self._token_expiry = None
+        self._token_lock = threading.Lock()
+        self._msal_app = None
         
         self._validate_config()
     
@@ -99,22 +232,31 @@ class MailDownloaderGraph:
     
     def get_access_token(self) -> str:
         """Holt ein OAuth2-Token für Microsoft Graph API (nur einmal pro Programmstart)"""
+        with self._token_lock:
+            return self._get_access_token_locked()
+    
+    def _get_access_token_locked(self) -> str:
+        """Holt bzw. erneuert das Token (Aufrufer hält self._token_lock)"""
         # Prüfe, ob Token schon existiert und noch gültig ist
         if self._access_token and self._token_expiry and time.time() < self._token_expiry:
             return self._access_token
         logger.info("Hole OAuth2-Token für Microsoft Graph...")
-        app = msal.ConfidentialClientApplication(
-            client_id=self.client_id,
-            client_credential=self.client_secret,
-            authority=f"https://login.microsoftonline.com/{self.tenant_id}"
-        )
+        # MSAL-App nur einmal anlegen, damit ihr interner Token-Cache erhalten bleibt
+        if self._msal_app is None:
+            self._msal_app = msal.ConfidentialClientApplication(
+                client_id=self.client_id,
+                client_credential=self.client_secret,
+                authority=f"https://login.microsoftonline.com/{self.tenant_id}"
+            )
         scopes = ['https://graph.microsoft.com/.default']
-        result = app.acquire_token_silent(scopes, account=None)
+        result = self._msal_app.acquire_token_silent(scopes, account=None)
         if not result:
-            result = app.acquire_token_for_client(scopes=scopes)
+            result = self._msal_app.acquire_token_for_client(scopes=scopes)
         if result and "access_token" in result:
             logger.info("OAuth2-Token erfolgreich erhalten")
             self._access_token = result['access_token']
+            # Alle Anfragen über die Session verwenden automatisch das aktuelle Token
+            self._session.headers['Authorization'] = f"Bearer {self._access_token}"
             # Token-Ablaufzeit berechnen (Standard: 3600s, kann aber variieren)
             expires_in = result.get('expires_in', 3600)
             self._token_expiry = time.time() + expires_in - 60  # 1 Min Puffer
@@ -124,10 +266,201 @@ class MailDownloaderGraph:
             logger.error(error_msg)
             raise ValueError(error_msg)
     
-    def sanitize_filename(self, filename: str) -> str:
-        """Bereinigt Dateinamen von ungültigen Zeichen und kürzt auf 50 Zeichen"""
-        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-        filename = re.sub(r'_+', '_', filename)
+    def _graph_get(self, url: str, **kwargs):
+        """GET-Anfrage an Graph über die gemeinsame Session"""
+        return self._graph_request('GET', url, **kwargs)
+    
+    def _graph_request(self, method: str, url: str, **kwargs):
+        """Anfrage an Graph über die gemeinsame Session (Token wird bei Bedarf erneuert)
+        
+        Bei Drosselung (429/503) wird nach Retry-After bzw. mit exponentiellem Backoff wiederholt.
+        """
+        for attempt in range(_GRAPH_MAX_RETRIES + 1):
+            self.get_access_token()
+            response = self._session.request(method, url, **kwargs)
+            if response.status_code not in _GRAPH_RETRY_STATUS or attempt == _GRAPH_MAX_RETRIES:
+                return response
+            
+            retry_after = response.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else 2 ** attempt
+            logger.warning(f"Graph API gedrosselt (HTTP {response.status_code}), "
+                           f"neuer Versuch in {delay}s ({attempt + 1}/{_GRAPH_MAX_RETRIES})")
+            # Verbindung freigeben (relevant bei stream=True)
+            response.close()
+            time.sleep(delay)
+    
+    def _fetch_graph_page(self, url: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Lädt eine Ergebnisseite von Graph und gibt die JSON-Antwort zurück"""
+        response = self._graph_get(url, params=params)
+        response.raise_for_status()
+        return loads_json(response.content)
+    
+    def _start_run(self):
+        """Setzt die pro Lauf gültigen Werte: Zeitfenster (UTC, wie von Graph erwartet) und Ordner-Cache"""
+        self._window_start = (datetime.now(timezone.utc) - timedelta(days=self.days_back)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        with self._folders_lock:
+            self._folders_cache = None
+            self._folder_id_cache = {}
+        with self._detail_lock:
+            self._detail_failures = 0
+            self._detail_first_error = None
+    
+    def _list_folders(self) -> List[Dict[str, Any]]:
+        """Liefert die Ordner des Postfachs (einmal pro Lauf von Graph geladen)"""
+        with self._folders_lock:
+            if self._folders_cache is None:
+                url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders"
+                response = self._graph_get(url)
+                response.raise_for_status()
+                
+                self._folders_cache = loads_json(response.content).get('value', [])
+                for folder in self._folders_cache:
+                    self._folder_id_cache.setdefault(folder.get('displayName', '').lower(), folder.get('id'))
+            return self._folders_cache
+    
+    def _scan_existing_files(self) -> set:
+        """Liest die Namen aller Dateien im E-Mail-Verzeichnis in einem Durchlauf ein"""
+        with os.scandir(self.mail_dir) as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    
+    def _load_sync_state(self) -> Dict[str, Any]:
+        """Lädt den gespeicherten Abgleich-Stand ({'folders': {Ordner: {...}}})"""
+        if not self.incremental_sync or not self.sync_state_file.exists():
+            return {'folders': {}}
+        try:
+            with open(self.sync_state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            state.setdefault('folders', {})
+            return state
+        except (OSError, ValueError) as e:
+            logger.warning(f"Abgleich-Stand nicht lesbar, lade vollständig: {e}")
+            return {'folders': {}}
+    
+    def _save_sync_state(self):
+        """Speichert den Abgleich-Stand (atomar über eine temporäre Datei)"""
+        if not self.incremental_sync:
+            return
+        tmp_file = self.sync_state_file.with_suffix('.tmp')
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._sync_state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.sync_state_file)
+        except OSError as e:
+            logger.warning(f"Abgleich-Stand konnte nicht gespeichert werden: {e}")
+    
+    def _load_saved_message_ids(self) -> Dict[str, str]:
+        """Lädt den Index der bereits gespeicherten Nachrichten ({Graph-ID: Dateiname})"""
+        if not self.seen_ids_file.exists():
+            return {}
+        try:
+            with open(self.seen_ids_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Nachrichten-Index nicht lesbar, beginne neu: {e}")
+            return {}
+    
+    def _save_saved_message_ids(self):
+        """Speichert den Nachrichten-Index (nur Einträge, deren Datei noch existiert)"""
+        saved_ids = {email_id: filename for email_id, filename in self._saved_message_ids.items()
+                     if filename in self._existing_files}
+        tmp_file = self.seen_ids_file.with_suffix('.tmp')
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(saved_ids, f, ensure_ascii=False)
+            os.replace(tmp_file, self.seen_ids_file)
+        except OSError as e:
+            logger.warning(f"Nachrichten-Index konnte nicht gespeichert werden: {e}")
+    
+    def _load_pdf_dedup_index(self) -> Dict[str, str]:
+        """Lädt den Hash-Index der gespeicherten PDFs ({SHA-256: Dateiname})"""
+        if not self.pdf_dedup_index_file.exists():
+            return {}
+        try:
+            with open(self.pdf_dedup_index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"PDF-Hash-Index nicht lesbar, beginne neu: {e}")
+            return {}
+    
+    def _save_pdf_dedup_index(self):
+        """Speichert den Hash-Index der PDFs, falls er sich geändert hat (atomar über eine temporäre Datei)"""
+        if not self._pdf_index_dirty:
+            return
+        tmp_file = self.pdf_dedup_index_file.with_suffix('.tmp')
+        try:
+            with self._pdf_lock:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(self._pdf_hash_index, f, ensure_ascii=False)
+                self._pdf_index_dirty = False
+            os.replace(tmp_file, self.pdf_dedup_index_file)
+        except OSError as e:
+            logger.warning(f"PDF-Hash-Index konnte nicht gespeichert werden: {e}")
+    
+    def _get_folder_since_date(self, folder_name: str, since_date: str) -> str:
+        """Liefert den Startzeitpunkt für einen Ordner unter Berücksichtigung des letzten Abgleichs"""
+        folder_state = self._sync_state['folders'].get(folder_name)
+        if not self.incremental_sync or not folder_state:
+            return since_date
+        
+        # Nur wenn der bereits abgeglichene Zeitraum das aktuelle Fenster abdeckt
+        # (ISO-Zeitstempel im gleichen Format lassen sich als Strings vergleichen)
+        if since_date >= folder_state['window_start']:
+            return max(since_date, folder_state['last_received'])
+        return since_date
+    
+    def _update_sync_state(self, folder_name: str, since_date: str, last_received: Optional[str]):
+        """Merkt sich, bis zu welchem Empfangszeitpunkt ein Ordner lückenlos geladen wurde"""
+        if not self.incremental_sync or not last_received:
+            return
+        folder_state = self._sync_state['folders'].get(folder_name)
+        window_start = since_date
+        if folder_state and since_date >= folder_state['window_start']:
+            window_start = folder_state['window_start']
+        self._sync_state['folders'][folder_name] = {
+            'window_start': window_start,
+            'last_received': last_received
+        }
+    
+    def _get_html_converter(self) -> html2text.HTML2Text:
+        """Liefert den HTML-zu-Text-Konverter des aktuellen Threads"""
+        converter = getattr(self._thread_local, 'html_converter', None)
+        if converter is None:
+            converter = _MailHTML2Text()
+            self._thread_local.html_converter = converter
+        return converter
+    
+    def _html_to_text(self, email_content: str) -> str:
+        """Konvertiert HTML in Text (selectolax/Lexbor, falls verfügbar, sonst html2text)"""
+        if not SELECTOLAX_AVAILABLE:
+            return self._get_html_converter().handle(email_content)
+        
+        tree = LexborHTMLParser(email_content)
+        # Nicht sichtbare Inhalte komplett entfernen
+        tree.strip_tags(['head', 'script', 'style'])
+        
+        # Links erhalten: "Text (URL)"
+        for link in tree.css('a[href]'):
+            href = link.attributes.get('href') or ''
+            link_text = link.text(separator=' ', strip=True)
+            if href and link_text and link_text != href:
+                link.replace_with(f"{link_text} ({href})")
+            elif href:
+                link.replace_with(href)
+        
+        root = tree.body or tree.root
+        text = root.text(separator='\n') if root else ''
+        if not text.strip() and email_content.strip():
+            # Kein Text gefunden (z. B. defektes Markup): auf html2text zurückfallen
+            return self._get_html_converter().handle(email_content)
+        return text
+    
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def sanitize_filename(filename: str) -> str:
+        """Bereinigt Dateinamen von ungültigen Zeichen und kürzt auf 50 Zeichen (gecacht, da sich Betreffs oft wiederholen)"""
+        filename = filename.translate(_INVALID_FN_TABLE)
+        if '__' in filename:
+            filename = _MULTI_UNDERSCORE.sub('_', filename)
         filename = filename.strip()
         if len(filename) > 50:
             filename = filename[:50]
@@ -135,237 +468,178 @@ class MailDownloaderGraph:
     
     def extract_text_from_email(self, email_content: str, content_type: str = 'text/plain') -> str:
         """Extrahiert reinen Text aus E-Mail-Inhalt"""
-        if content_type.startswith('text/html'):
-            # HTML zu Text konvertieren
-            text = self.html_converter.handle(email_content)
+        # Graph liefert 'html'/'text', MIME-Typen wie 'text/html' werden ebenfalls erkannt
+        content_type = content_type.lower()
+        if content_type == 'html' or content_type[:9] == 'text/html':
+            # HTML zu Text konvertieren (der Parser entfernt die Tags und dekodiert Entities bereits)
+            text = self._html_to_text(email_content)
         else:
-            # Plain text
-            text = email_content
-        
-        # Text bereinigen
-        text = text.strip()
-        
-        # HTML-Tags entfernen (falls noch welche übrig sind)
-        import re
-        text = re.sub(r'<[^>]+>', '', text)
-        
-        # HTML-Entities dekodieren
-        import html
-        text = html.unescape(text)
-        
-        # Mehrfache Leerzeichen entfernen
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Mehrfache Zeilenumbrüche entfernen
-        text = re.sub(r'\n\s*\n', '\n\n', text)
-        
-        # Leerzeichen am Anfang und Ende von Zeilen entfernen
-        text = '\n'.join(line.strip() for line in text.split('\n'))
+            # Plain text ohne Tags und Entities: die Bereinigung unten reduziert sich
+            # auf das Zusammenfassen von Leerraum, das split/join direkt erledigt
+            if '<' not in email_content and '&' not in email_content:
+                return ' '.join(email_content.split())
+            
+            # HTML-Tags entfernen und HTML-Entities dekodieren (falls welche enthalten sind)
+            text = html.unescape(_HTML_TAG.sub('', email_content))
         
-        return text
+        # Leerraum (auch Zeilenumbrüche) zu einzelnen Leerzeichen zusammenfassen und Ränder entfernen
+        return ' '.join(text.split())
     
-    def get_emails_from_graph(self, access_token: str) -> List[Dict[str, Any]]:
-        """Holt E-Mails von Microsoft Graph API"""
-        logger.info("Hole E-Mails von Microsoft Graph API...")
-        
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+    def _get_folder_messages_url(self, folder_name: str, folder_id: Optional[str] = None) -> Optional[str]:
+        """Liefert die URL der Nachrichtenliste eines Ordners (None, falls der Ordner nicht existiert)"""
+        if folder_name.lower() == "inbox":
+            return f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/inbox/messages"
+        if folder_name.lower() == "archive":
+            return f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/archive/messages"
         
-        # Zeitraum definieren
-        since_date = (datetime.now() - timedelta(days=self.days_back)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        # Für andere Ordner müssen wir zuerst die Ordner-ID finden (falls nicht bekannt)
+        if not folder_id:
+            folder_id = self._get_folder_id(folder_name)
+        if not folder_id:
+            return None
+        return f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/{folder_id}/messages"
+    
+    def _iter_message_pages(self, folder_name: str, since_date: str,
+                            folder_id: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+        """Liefert die E-Mails eines Ordners seitenweise (aufsteigend nach Empfangsdatum, nur Metadaten)
         
-        all_emails = []
+        Folgeseiten kommen über @odata.nextLink und werden bereits geladen, während der
+        Aufrufer die aktuelle Seite verarbeitet. MAX_EMAILS_PER_FOLDER begrenzt die Seiten.
+        """
+        url = self._get_folder_messages_url(folder_name, folder_id)
+        if not url:
+            logger.warning(f"Ordner '{folder_name}' nicht gefunden")
+            return
         
-        # 1. Posteingang (Inbox)
-        logger.info("Lade E-Mails aus dem Posteingang...")
-        inbox_emails = self._get_emails_from_folder(access_token, headers, since_date, "Inbox")
-        all_emails.extend(inbox_emails)
+        # Erste Seite mit Abfrageparametern; Folgeseiten über @odata.nextLink
+        # (serverseitiger Cursor statt $skip, das den Ordner jedes Mal neu durchläuft)
+        params = {
+            '$top': self.chunk_size,
+            '$orderby': 'receivedDateTime asc',
+            '$filter': f"receivedDateTime ge {since_date}",
+            '$select': _GRAPH_MESSAGE_LIST_SELECT
+        }
         
-        logger.info(f"E-Mails aus Inbox geladen: {len(inbox_emails)}")
+        fetched_count = 0
+        chunk_number = 0
+        pending_page = self._prefetch_executor.submit(self._fetch_graph_page, url, params)
         
-        # 2. Unterverzeichnisse (Ordner)
-        if self.include_folders:
-            logger.info("Lade E-Mails aus Unterverzeichnissen...")
-            folder_emails = self._get_emails_from_folders(access_token, headers, since_date)
-            all_emails.extend(folder_emails)
+        while True:
+            chunk_number += 1
+            logger.info(f"Lade Chunk {chunk_number} für {folder_name} (bisher: {fetched_count})")
             
-            logger.info(f"E-Mails aus Ordnern geladen: {len(folder_emails)}")
-        
-        # 3. Archiv
-        if self.include_archive:
-            logger.info("Lade E-Mails aus dem Archiv...")
-            try:
-                archive_emails = self._get_emails_from_folder(access_token, headers, since_date, "Archive")
-                all_emails.extend(archive_emails)
-                
-                logger.info(f"E-Mails aus Archiv geladen: {len(archive_emails)}")
-            except Exception as e:
-                logger.warning(f"Archiv nicht verfügbar: {e}")
-        
-        logger.info(f"Gesamt E-Mails von Graph API erhalten: {len(all_emails)}")
-        return all_emails
-    
-    def _get_emails_from_folder(self, access_token: str, headers: Dict[str, str], since_date: str, folder_name: str) -> List[Dict[str, Any]]:
-        """Holt E-Mails aus einem spezifischen Ordner mit Chunk-basiertem Laden"""
-        try:
-            # Graph API Anfrage für spezifischen Ordner
-            if folder_name.lower() == "inbox":
-                url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/inbox/messages"
-            elif folder_name.lower() == "archive":
-                url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/archive/messages"
-            else:
-                # Für andere Ordner müssen wir zuerst die Ordner-ID finden
-                folder_id = self._get_folder_id(access_token, headers, folder_name)
-                if not folder_id:
-                    logger.warning(f"Ordner '{folder_name}' nicht gefunden")
-                    return []
-                url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/{folder_id}/messages"
-            
-            all_emails = []
-            skip_count = 0
-            
-            while True:
-                params = {
-                    '$top': self.chunk_size,
-                    '$skip': skip_count,
-                    '$orderby': 'receivedDateTime asc',
-                    '$filter': f"receivedDateTime ge {since_date}",
-                    '$select': 'id,subject,from,toRecipients,receivedDateTime,body,bodyPreview',
-                    '$expand': 'attachments'
-                }
-                
-                logger.info(f"Lade Chunk {skip_count//self.chunk_size + 1} für {folder_name} (Skip: {skip_count})")
-                
-                response = requests.get(url, headers=headers, params=params)
-                response.raise_for_status()
-                
-                data = response.json()
-                emails = data.get('value', [])
-                
-                if not emails:
-                    logger.info(f"Keine weiteren E-Mails in {folder_name}")
-                    break
-                
-                # Ordner-Information zu jeder E-Mail hinzufügen
-                for email in emails:
-                    email['folder_name'] = folder_name
-                
-                all_emails.extend(emails)
-                logger.info(f"Chunk geladen: {len(emails)} E-Mails aus {folder_name}")
-                
-                # Prüfe ob wir alle E-Mails laden sollen oder nur bis max_emails
-                if not self.load_all_emails and len(all_emails) >= self.max_emails:
-                    logger.info(f"Maximale Anzahl E-Mails ({self.max_emails}) erreicht für {folder_name}")
-                    all_emails = all_emails[:self.max_emails]
-                    break
-                
-                # Prüfe ob es weitere E-Mails gibt
-                if len(emails) < self.chunk_size:
-                    logger.info(f"Alle E-Mails aus {folder_name} geladen")
-                    break
-                
-                skip_count += self.chunk_size
-                
-                # Optionaler Sicherheitscheck: Maximal E-Mails pro Ordner
-                if self.max_emails_per_folder > 0 and skip_count >= self.max_emails_per_folder:
-                    logger.warning(f"Maximale Anzahl E-Mails ({self.max_emails_per_folder}) für {folder_name} erreicht")
-                    break
+            data = pending_page.result()
+            emails = data.get('value', [])
+            fetched_count += len(emails)
             
-            logger.info(f"Gesamt E-Mails aus {folder_name}: {len(all_emails)}")
-            return all_emails
+            # Nächste Seite bereits anfordern, während diese Seite verarbeitet wird
+            # (der nextLink enthält alle Abfrageparameter)
+            next_link = data.get('@odata.nextLink')
+            limit_reached = self.max_emails_per_folder > 0 and fetched_count >= self.max_emails_per_folder
+            if next_link and not limit_reached:
+                pending_page = self._prefetch_executor.submit(self._fetch_graph_page, next_link, None)
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Fehler bei Graph API Anfrage für {folder_name}: {e}")
-            return []
+            if not emails:
+                logger.info(f"Keine weiteren E-Mails in {folder_name}")
+                return
+            
+            yield emails
+            
+            # Prüfe ob es weitere E-Mails gibt
+            if not next_link:
+                logger.info(f"Alle E-Mails aus {folder_name} geladen")
+                return
+            
+            # Optionaler Sicherheitscheck: Maximal E-Mails pro Ordner
+            if limit_reached:
+                logger.warning(f"Maximale Anzahl E-Mails ({self.max_emails_per_folder}) für {folder_name} erreicht")
+                return
     
-    def _get_folder_id(self, access_token: str, headers: Dict[str, str], folder_name: str) -> Optional[str]:
-        """Findet die ID eines Ordners anhand des Namens"""
+    def _get_folder_id(self, folder_name: str) -> Optional[str]:
+        """Findet die ID eines Ordners anhand des Namens (zuerst in der bereits geladenen Ordnerliste)"""
+        cache_key = folder_name.lower()
+        with self._folders_lock:
+            if cache_key in self._folder_id_cache:
+                return self._folder_id_cache[cache_key]
+        
         try:
             url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders"
             params = {
                 '$filter': f"displayName eq '{folder_name}'"
             }
             
-            response = requests.get(url, headers=headers, params=params)
+            response = self._graph_get(url, params=params)
             response.raise_for_status()
             
-            data = response.json()
+            data = loads_json(response.content)
             folders = data.get('value', [])
             
-            if folders:
-                return folders[0]['id']
-            else:
-                return None
+            folder_id = folders[0]['id'] if folders else None
+            with self._folders_lock:
+                self._folder_id_cache[cache_key] = folder_id
+            return folder_id
                 
         except requests.exceptions.RequestException as e:
             logger.error(f"Fehler beim Suchen des Ordners {folder_name}: {e}")
             return None
     
-    def _get_emails_from_folders(self, access_token: str, headers: Dict[str, str], since_date: str) -> List[Dict[str, Any]]:
-        """Holt E-Mails aus allen verfügbaren Ordnern"""
-        all_emails = []
-        
-        try:
-            # Alle Ordner auflisten
-            url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders"
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            folders = data.get('value', [])
-            
-            for folder in folders:
-                folder_name = folder.get('displayName', '')
-                
-                # Überspringe spezielle Ordner
-                if folder_name.lower() in ['inbox', 'archive', 'sent items', 'deleted items', 'drafts']:
-                    continue
-                
-                logger.info(f"Prüfe Ordner: {folder_name}")
-                try:
-                    folder_emails = self._get_emails_from_folder(access_token, headers, since_date, folder_name)
-                    all_emails.extend(folder_emails)
-                except Exception as e:
-                    logger.warning(f"Fehler beim Zugriff auf Ordner {folder_name}: {e}")
-                    continue
-        
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Fehler beim Auflisten der Ordner: {e}")
-        
-        return all_emails
-    
     def download_via_graph_api(self) -> List[str]:
         """Lädt E-Mails über Microsoft Graph API herunter"""
         logger.info("Starte E-Mail-Download über Microsoft Graph API...")
         
-        # OAuth2-Token holen
-        access_token = self.get_access_token()
+        # OAuth2-Token holen (die Session trägt danach den Authorization-Header)
+        self.get_access_token()
+        self._start_run()
+        
+        logger.info(f"{len(self._existing_files)} vorhandene Dateien in {self.mail_dir}")
         
         # E-Mails direkt laden und speichern
         downloaded_files = []
         seen_email_ids = set()
         
+        # Zu ladende Ordner bestimmen: (Ordnername, Ordner-ID, Warnung bei Fehler; None = Fehler weiterreichen)
         # 1. Posteingang (Inbox)
-        logger.info("Lade und speichere E-Mails aus dem Posteingang...")
-        inbox_files = self._download_and_save_emails_from_folder(access_token, "Inbox", seen_email_ids)
-        downloaded_files.extend(inbox_files)
+        folder_jobs = [("Inbox", None, None)]
         
         # 2. Unterverzeichnisse (Ordner)
         if self.include_folders:
             logger.info("Lade und speichere E-Mails aus Unterverzeichnissen...")
-            folder_files = self._download_and_save_emails_from_folders(access_token, seen_email_ids)
-            downloaded_files.extend(folder_files)
+            folder_jobs.extend(
+                (folder_name, folder_id, f"Fehler beim Zugriff auf Ordner {folder_name}")
+                for folder_name, folder_id in self._list_subfolders()
+            )
         
         # 3. Archiv
         if self.include_archive:
-            logger.info("Lade und speichere E-Mails aus dem Archiv...")
-            try:
-                archive_files = self._download_and_save_emails_from_folder(access_token, "Archive", seen_email_ids)
-                downloaded_files.extend(archive_files)
-            except Exception as e:
-                logger.warning(f"Archiv nicht verfügbar: {e}")
+            folder_jobs.append(("Archive", None, "Archiv nicht verfügbar"))
+        
+        # Ordner parallel laden (netzwerkgebunden); Ergebnisse in fester Ordnerreihenfolge einsammeln
+        logger.info(f"Lade und speichere E-Mails aus {len(folder_jobs)} Ordnern "
+                    f"({self.folder_workers} parallel)...")
+        with ThreadPoolExecutor(max_workers=self.folder_workers) as executor:
+            futures = [
+                executor.submit(self._download_and_save_emails_from_folder, folder_name, seen_email_ids, folder_id)
+                for folder_name, folder_id, _ in folder_jobs
+            ]
+            for (folder_name, _, warning), future in zip(folder_jobs, futures):
+                try:
+                    downloaded_files.extend(future.result())
+                except Exception as e:
+                    if warning is None:
+                        raise
+                    logger.warning(f"{warning}: {e}")
+        
+        self._save_sync_state()
+        self._save_saved_message_ids()
+        self._save_pdf_dedup_index()
+        
+        if self._detail_failures:
+            logger.error(f"Details von {self._detail_failures} E-Mails konnten nicht geladen werden "
+                         f"(erster Fehler: {self._detail_first_error}); sie werden beim nächsten Lauf erneut versucht")
+            if not downloaded_files:
+                # Kein stiller Leerlauf: z. B. eine von Graph abgelehnte Detail-Abfrage betrifft alle E-Mails
+                raise MessageDetailsError(f"Keine E-Mail gespeichert, Details von {self._detail_failures} E-Mails "
+                                          f"konnten nicht geladen werden: {self._detail_first_error}")
         
         logger.info(f"Gesamt eindeutige E-Mails heruntergeladen: {len(downloaded_files)}")
         return downloaded_files
@@ -379,164 +653,248 @@ class MailDownloaderGraph:
         
         try:
             return self.download_via_graph_api()
+        except MessageDetailsError:
+            raise
         except Exception as e:
             logger.error(f"Fehler beim E-Mail-Download: {e}")
             return []
     
-    def _download_and_save_emails_from_folder(self, access_token: str, folder_name: str, seen_email_ids: set) -> List[str]:
-        """Lädt E-Mails aus einem Ordner und speichert sie direkt"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        # Zeitraum definieren
-        since_date = (datetime.now() - timedelta(days=self.days_back)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    def _download_and_save_emails_from_folder(self, folder_name: str, seen_email_ids: set,
+                                              folder_id: Optional[str] = None) -> List[str]:
+        """Lädt E-Mails aus einem Ordner und speichert sie direkt (folder_id spart die Suche nach dem Namen)"""
+        # Zeitraum definieren (einmal pro Lauf berechnet)
+        if self._window_start is None:
+            self._start_run()
+        window_start = self._window_start
+        since_date = self._get_folder_since_date(folder_name, window_start)
+        if since_date != window_start:
+            logger.info(f"Inkrementeller Abgleich für {folder_name} ab {since_date}")
         
         downloaded_files = []
-        skip_count = 0
+        # Empfangszeitpunkt, bis zu dem alle E-Mails (aufsteigend sortiert) gespeichert wurden
+        last_received = None
+        gap = False
         
         try:
-            # Graph API Anfrage für spezifischen Ordner
-            if folder_name.lower() == "inbox":
-                url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/inbox/messages"
-            elif folder_name.lower() == "archive":
-                url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/archive/messages"
-            else:
-                # Für andere Ordner müssen wir zuerst die Ordner-ID finden
-                folder_id = self._get_folder_id(access_token, headers, folder_name)
-                if not folder_id:
-                    logger.warning(f"Ordner '{folder_name}' nicht gefunden")
-                    return []
-                url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders/{folder_id}/messages"
-            
-            while True:
-                params = {
-                    '$top': self.chunk_size,
-                    '$skip': skip_count,
-                    '$orderby': 'receivedDateTime asc',
-                    '$filter': f"receivedDateTime ge {since_date}",
-                    '$select': 'id,subject,from,toRecipients,receivedDateTime,body,bodyPreview',
-                    '$expand': 'attachments'
-                }
-                
-                logger.info(f"Lade Chunk {skip_count//self.chunk_size + 1} für {folder_name} (Skip: {skip_count})")
-                
-                response = requests.get(url, headers=headers, params=params)
-                response.raise_for_status()
+            # Nur Metadaten, Body und Anhänge folgen für neue E-Mails über _load_message_details
+            for emails in self._iter_message_pages(folder_name, since_date, folder_id):
+                # E-Mails deduplizieren (seen_email_ids wird von allen Ordnern geteilt)
+                new_emails = []
+                with self._seen_lock:
+                    for email_data in emails:
+                        email_id = email_data.get('id')
+                        
+                        # Deduplizierung
+                        if email_id and email_id in seen_email_ids:
+                            continue
+                        
+                        seen_email_ids.add(email_id)
+                        new_emails.append(email_data)
                 
-                data = response.json()
-                emails = data.get('value', [])
+                # Bereits gespeicherte E-Mails überspringen, bevor Text extrahiert wird
+                already_saved = [self._is_already_downloaded(email_data, folder_name) for email_data in new_emails]
+                to_save = [email_data for email_data, saved in zip(new_emails, already_saved) if not saved]
                 
-                if not emails:
-                    logger.info(f"Keine weiteren E-Mails in {folder_name}")
-                    break
+                # Body und Anhänge nur für die zu speichernden E-Mails laden
+                failed_ids = self._load_message_details(to_save)
                 
-                # E-Mails verarbeiten und speichern
+                # E-Mails parallel speichern (Text-Extraktion, Schreiben und PDF-Download
+                # sind pro E-Mail unabhängig; die Reihenfolge bleibt erhalten)
                 chunk_saved = 0
-                for email_data in emails:
-                    email_id = email_data.get('id')
-                    
-                    # Deduplizierung
-                    if email_id and email_id in seen_email_ids:
-                        continue
-                    
-                    seen_email_ids.add(email_id)
-                    
-                    try:
-                        # E-Mail speichern
-                        filepath = self._save_email_data(email_data, folder_name)
-                        if filepath:
-                            downloaded_files.append(filepath)
-                            chunk_saved += 1
-                    except Exception as e:
-                        logger.error(f"Fehler beim Speichern der E-Mail: {e}")
-                        continue
+                results = self._save_executor.map(
+                    lambda email_data: None if email_data.get('id') in failed_ids
+                    else self._save_email_data(email_data, folder_name),
+                    to_save
+                )
+                for email_data, saved in zip(new_emails, already_saved):
+                    filepath = None if saved else next(results)
+                    if filepath:
+                        downloaded_files.append(filepath)
+                        chunk_saved += 1
+                    if saved or filepath:
+                        if not gap:
+                            last_received = email_data.get('receivedDateTime') or last_received
+                    else:
+                        # Fehlgeschlagene E-Mail beim nächsten Lauf erneut laden
+                        gap = True
                 
-                logger.info(f"Chunk geladen: {len(emails)} E-Mails aus {folder_name}, {chunk_saved} neue gespeichert")
+                logger.info(f"Chunk geladen: {len(emails)} E-Mails aus {folder_name}, {chunk_saved} neue gespeichert, "
+                            f"{len(new_emails) - len(to_save)} bereits vorhanden")
                 
                 # Prüfe ob wir alle E-Mails laden sollen oder nur bis max_emails
                 if not self.load_all_emails and len(downloaded_files) >= self.max_emails:
                     logger.info(f"Maximale Anzahl E-Mails ({self.max_emails}) erreicht für {folder_name}")
                     break
-                
-                # Prüfe ob es weitere E-Mails gibt
-                if len(emails) < self.chunk_size:
-                    logger.info(f"Alle E-Mails aus {folder_name} geladen")
-                    break
-                
-                skip_count += self.chunk_size
-                
-                # Optionaler Sicherheitscheck: Maximal E-Mails pro Ordner
-                if self.max_emails_per_folder > 0 and skip_count >= self.max_emails_per_folder:
-                    logger.warning(f"Maximale Anzahl E-Mails ({self.max_emails_per_folder}) für {folder_name} erreicht")
-                    break
             
             logger.info(f"Gesamt E-Mails aus {folder_name} gespeichert: {len(downloaded_files)}")
+            self._update_sync_state(folder_name, window_start, last_received)
             return downloaded_files
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Fehler bei Graph API Anfrage für {folder_name}: {e}")
             return []
     
-    def _download_and_save_emails_from_folders(self, access_token: str, seen_email_ids: set) -> List[str]:
-        """Lädt E-Mails aus allen verfügbaren Ordnern und speichert sie direkt"""
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+    def _message_details_path(self, email_id: str) -> str:
+        """Relativer Graph-Pfad für Body und Anhänge einer E-Mail"""
+        return (f"/users/{self.email_address}/messages/{email_id}"
+                f"?$select={_GRAPH_MESSAGE_DETAIL_SELECT}&$expand={_GRAPH_ATTACHMENT_EXPAND}")
+    
+    def _record_detail_failure(self, email_id: Optional[str], error: Any):
+        """Protokolliert eine fehlgeschlagene Detail-Abfrage und zählt sie für den Lauf"""
+        logger.error(f"Fehler beim Laden der E-Mail-Details ({email_id}): {error}")
+        with self._detail_lock:
+            self._detail_failures += 1
+            if self._detail_first_error is None:
+                self._detail_first_error = str(error)
+    
+    def _load_message_details(self, emails: List[Dict[str, Any]]) -> set:
+        """Lädt Body und Anhänge der E-Mails nach (parallel, je bis zu 20 pro $batch-Anfrage)
         
-        downloaded_files = []
+        Die Daten werden in die E-Mail-Dicts übernommen; zurückgegeben werden die IDs,
+        deren Details nicht geladen werden konnten.
+        """
+        batches = [emails[start:start + _GRAPH_BATCH_LIMIT] for start in range(0, len(emails), _GRAPH_BATCH_LIMIT)]
+        failed_ids = set()
+        for batch_failed_ids in self._save_executor.map(self._load_message_details_batch, batches):
+            failed_ids.update(batch_failed_ids)
+        return failed_ids
+    
+    def _load_message_details_batch(self, emails: List[Dict[str, Any]]) -> set:
+        """Lädt Body und Anhänge für bis zu 20 E-Mails über eine $batch-Anfrage"""
+        # Body serverseitig als Text anfordern (gilt pro Teilanfrage)
+        sub_headers = {'Prefer': 'outlook.body-content-type="text"'} if self.prefer_text_body else {}
+        
+        details = {}
+        rejected = {}
+        if len(emails) > 1:
+            batch_request = {
+                'requests': [
+                    {
+                        'id': str(index),
+                        'method': 'GET',
+                        'url': self._message_details_path(email_data.get('id')),
+                        'headers': sub_headers
+                    }
+                    for index, email_data in enumerate(emails)
+                ]
+            }
+            try:
+                response = self._graph_request('POST', f"{self.graph_endpoint}/$batch", json=batch_request)
+                response.raise_for_status()
+                
+                for sub_response in loads_json(response.content).get('responses', []):
+                    body = sub_response.get('body')
+                    status = sub_response.get('status')
+                    if status == 200 and isinstance(body, dict):
+                        details[int(sub_response['id'])] = body
+                    elif isinstance(status, int) and 400 <= status < 500 and status != 429:
+                        # Von Graph abgelehnt (z. B. ungültige Abfrage): einzeln erneut laden hilft nicht
+                        error = body.get('error') if isinstance(body, dict) else None
+                        message = error.get('message') if isinstance(error, dict) else None
+                        rejected[int(sub_response['id'])] = f"HTTP {status}: {message or body}"
+                        
+            except Exception as e:
+                logger.error(f"Fehler bei $batch-Anfrage für E-Mail-Details: {e}")
+        
+        failed_ids = set()
+        for index, email_data in enumerate(emails):
+            message_details = details.get(index)
+            if index in rejected:
+                self._record_detail_failure(email_data.get('id'), rejected[index])
+                failed_ids.add(email_data.get('id'))
+                continue
+            if message_details is None:
+                # Einzeln laden (einzelne E-Mail oder fehlgeschlagene/gedrosselte Teilanfrage)
+                try:
+                    response = self._graph_get(self.graph_endpoint + self._message_details_path(email_data.get('id')),
+                                               headers=sub_headers)
+                    response.raise_for_status()
+                    message_details = loads_json(response.content)
+                except Exception as e:
+                    self._record_detail_failure(email_data.get('id'), e)
+                    failed_ids.add(email_data.get('id'))
+                    continue
+            
+            for key in ('body', 'bodyPreview', 'attachments'):
+                if key in message_details:
+                    email_data[key] = message_details[key]
+        
+        return failed_ids
+    
+    def _list_subfolders(self) -> List[Tuple[str, str]]:
+        """Listet Name und ID aller Ordner auf, die zusätzlich zu Inbox und Archiv geladen werden"""
+        subfolders = []
         
         try:
             # Alle Ordner auflisten
-            url = f"{self.graph_endpoint}/users/{self.email_address}/mailFolders"
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            folders = data.get('value', [])
-            
-            for folder in folders:
+            for folder in self._list_folders():
                 folder_name = folder.get('displayName', '')
                 
                 # Überspringe spezielle Ordner
-                if folder_name.lower() in ['inbox', 'archive', 'sent items', 'deleted items', 'drafts']:
+                if folder_name.lower() in _SKIPPED_FOLDERS:
                     continue
                 
                 logger.info(f"Prüfe Ordner: {folder_name}")
-                try:
-                    folder_files = self._download_and_save_emails_from_folder(access_token, folder_name, seen_email_ids)
-                    downloaded_files.extend(folder_files)
-                except Exception as e:
-                    logger.warning(f"Fehler beim Zugriff auf Ordner {folder_name}: {e}")
-                    continue
+                subfolders.append((folder_name, folder.get('id')))
         
         except requests.exceptions.RequestException as e:
             logger.error(f"Fehler beim Auflisten der Ordner: {e}")
         
-        return downloaded_files
+        return subfolders
+    
+    def _parse_received_date(self, email_data: Dict[str, Any]) -> Optional[datetime]:
+        """Parst das Empfangsdatum einer E-Mail (None, falls nicht vorhanden oder ungültig)"""
+        received_date_str = email_data.get('receivedDateTime', '')
+        if received_date_str:
+            try:
+                if _FROMISOFORMAT_PARSES_Z:
+                    return datetime.fromisoformat(received_date_str)
+                return datetime.fromisoformat(received_date_str.replace('Z', '+00:00'))
+            except:
+                pass
+        return None
+    
+    def _get_email_date_str(self, received_date: Optional[datetime]) -> str:
+        """Liefert das Empfangsdatum (ersatzweise jetzt) im Dateinamen-Format"""
+        return (received_date or datetime.now()).strftime('%Y-%m-%d-%H-%M-%S')
+    
+    def _build_email_filename(self, email_data: Dict[str, Any], folder_name: str, date_str: str) -> str:
+        """Baut den Dateinamen einer E-Mail (Datum, Ordner-Präfix, Betreff)"""
+        subject = email_data.get('subject', 'Kein_Betreff')
+        subject = self.sanitize_filename(subject)
+        return f"{date_str}--[{folder_name}]--{subject}.txt"
+    
+    def _is_already_downloaded(self, email_data: Dict[str, Any], folder_name: str) -> bool:
+        """Prüft anhand der Nachrichten-ID bzw. des Dateinamens, ob die E-Mail bereits gespeichert wurde"""
+        # Schneller Weg: ID aus einem früheren Lauf bekannt und Datei noch vorhanden
+        email_id = email_data.get('id')
+        if self._saved_message_ids.get(email_id) in self._existing_files:
+            return True
+        
+        if not email_data.get('receivedDateTime'):
+            # Ohne Empfangsdatum ist der Dateiname nicht stabil
+            return False
+        try:
+            date_str = self._get_email_date_str(self._parse_received_date(email_data))
+            filename = self._build_email_filename(email_data, folder_name, date_str)
+        except Exception:
+            return False
+        if filename not in self._existing_files:
+            return False
+        if email_id:
+            self._saved_message_ids[email_id] = filename
+        return True
     
     def _save_email_data(self, email_data: Dict[str, Any], folder_name: str) -> Optional[str]:
         """Speichert eine einzelne E-Mail-Nachricht und lädt PDF-Attachments herunter"""
         try:
             # Empfangsdatum
             received_date_str = email_data.get('receivedDateTime', '')
-            if received_date_str:
-                try:
-                    received_date = datetime.fromisoformat(received_date_str.replace('Z', '+00:00'))
-                    date_str = received_date.strftime('%Y-%m-%d-%H-%M-%S')
-                except:
-                    date_str = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
-            else:
-                date_str = datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
-            
-            # Betreff
-            subject = email_data.get('subject', 'Kein_Betreff')
-            subject = self.sanitize_filename(subject)
+            received_date = self._parse_received_date(email_data)
+            date_str = self._get_email_date_str(received_date)
             
             # Dateiname mit Ordner-Präfix
-            filename = f"{date_str}--[{folder_name}]--{subject}.txt"
+            filename = self._build_email_filename(email_data, folder_name, date_str)
             filepath = self.mail_dir / filename
             
             # E-Mail-Inhalt extrahieren
@@ -551,33 +909,45 @@ class MailDownloaderGraph:
             extracted_text = self.extract_text_from_email(text_content, content_type)
             
             # Absender und Empfänger
-            from_info = email_data.get('from', {})
-            from_email = from_info.get('emailAddress', {}).get('address', 'Unbekannt')
-            from_name = from_info.get('emailAddress', {}).get('name', '')
+            from_address = email_data.get('from', {}).get('emailAddress', {})
+            from_email = from_address.get('address', 'Unbekannt')
+            from_name = from_address.get('name', '')
             
             to_recipients = email_data.get('toRecipients', [])
             to_email = to_recipients[0].get('emailAddress', {}).get('address', 'Unbekannt') if to_recipients else 'Unbekannt'
             
-            # Metadaten hinzufügen
-            email_text = f"""Von: {from_name} <{from_email}>
+            # Metadaten (der Text wird separat geschrieben statt in einen großen String kopiert)
+            email_header = f"""Von: {from_name} <{from_email}>
 An: {to_email}
 Datum: {received_date_str}
 Betreff: {email_data.get('subject', 'Kein Betreff')}
 Ordner: {folder_name}
 
-{extracted_text}
 """
             
             # Datei speichern
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(email_text)
+            with open(filepath, 'w', encoding='utf-8', buffering=65536) as f:
+                f.write(email_header)
+                f.write(extracted_text)
+                f.write('\n')
+            self._existing_files.add(filename)
+            if email_data.get('id'):
+                self._saved_message_ids[email_data['id']] = filename
             
-            logger.info(f"E-Mail gespeichert: {filename}")
+            # Änderungszeit der Datei auf das Empfangsdatum setzen (Sortierung nach mtime möglich)
+            if received_date:
+                received_ts = received_date.timestamp()
+                try:
+                    os.utime(filepath, (received_ts, received_ts))
+                except OSError as e:
+                    logger.debug(f"Zeitstempel für {filename} nicht gesetzt: {e}")
+            
+            logger.debug(f"E-Mail gespeichert: {filename}")
             
             # PDF-Attachments herunterladen
             pdf_files = self._download_pdf_attachments(email_data, folder_name, date_str)
             if pdf_files:
-                logger.info(f"{len(pdf_files)} PDF-Attachments für E-Mail heruntergeladen")
+                logger.debug(f"{len(pdf_files)} PDF-Attachments für E-Mail heruntergeladen")
             
             return str(filepath)
             
@@ -600,45 +970,69 @@ Ordner: {folder_name}
             if not pdf_attachments:
                 return downloaded_pdfs
             
-            logger.info(f"Lade {len(pdf_attachments)} PDF-Attachments...")
+            logger.debug(f"Lade {len(pdf_attachments)} PDF-Attachments...")
             
+            email_id = email_data.get('id')
+            
+            # Zu ladende Attachments bestimmen: (Attachment-ID, Dateiname, Dateipfad)
+            pending = []
             for attachment in pdf_attachments:
-                try:
-                    attachment_name = attachment.get('name', 'Unbekannt.pdf')
-                    attachment_id = attachment.get('id')
-                    email_id = email_data.get('id')
-                    
-                    if not attachment_id or not email_id:
-                        logger.warning(f"Keine ID für Attachment oder E-Mail: {attachment_name}")
-                        continue
-                    
-                    # Deduplizierung: Überspringe bereits gesehene PDF-Attachments
+                attachment_name = attachment.get('name', 'Unbekannt.pdf')
+                attachment_id = attachment.get('id')
+                
+                if not attachment_id or not email_id:
+                    logger.warning(f"Keine ID für Attachment oder E-Mail: {attachment_name}")
+                    continue
+                
+                # Deduplizierung: Überspringe bereits gesehene PDF-Attachments
+                # (ID wird vorab reserviert, damit parallele Worker sie nicht doppelt laden)
+                with self._pdf_lock:
                     if attachment_id in self.seen_pdf_attachment_ids:
-                        logger.info(f"PDF-Attachment bereits heruntergeladen, überspringe: {attachment_name}")
+                        logger.debug(f"PDF-Attachment bereits heruntergeladen, überspringe: {attachment_name}")
                         continue
+                    self.seen_pdf_attachment_ids.add(attachment_id)
+                
+                # PDF-Dateiname mit Timestamp erstellen
+                safe_name = self.sanitize_filename(attachment_name)
+                if not safe_name.lower().endswith('.pdf'):
+                    safe_name += '.pdf'
+                
+                pdf_filename = f"{date_str}--[{folder_name}]--{safe_name}"
+                pending.append((attachment_id, pdf_filename, self.pdf_dir / pdf_filename))
+            
+            # Inhalte über /$value laden: mehrere gebündelt über $batch, ein einzelnes direkt gestreamt
+            pdf_contents = {}
+            if len(pending) > 1:
+                pdf_contents = self._download_attachments_batch(email_id, [item[0] for item in pending])
+            
+            for attachment_id, pdf_filename, pdf_filepath in pending:
+                try:
+                    # Vorhandene Datei entfernen statt überschreiben (sie kann ein Hardlink sein)
+                    self._release_pdf_path(pdf_filepath)
                     
-                    # PDF-Dateiname mit Timestamp erstellen
-                    safe_name = self.sanitize_filename(attachment_name)
-                    if not safe_name.lower().endswith('.pdf'):
-                        safe_name += '.pdf'
-                    
-                    pdf_filename = f"{date_str}--[{folder_name}]--{safe_name}"
-                    pdf_filepath = self.pdf_dir / pdf_filename
+                    # PDF-Daten übernehmen bzw. einzeln direkt in die Datei streamen
+                    pdf_content = pdf_contents.pop(attachment_id, None)
+                    if pdf_content is not None:
+                        digest = self._store_pdf_content(pdf_content, pdf_filepath)
+                    else:
+                        digest = self._download_attachment_content(email_id, attachment_id, pdf_filepath)
+                        if digest:
+                            # Gestreamter Inhalt bereits vorhanden: Datei durch Hardlink ersetzen
+                            self._link_known_pdf(digest, pdf_filepath)
                     
-                    # PDF-Daten herunterladen
-                    pdf_content = self._download_attachment_content(email_id, attachment_id)
-                    if pdf_content:
-                        with open(pdf_filepath, 'wb') as f:
-                            f.write(pdf_content)
-                        
-                        # Attachment-ID als gesehen markieren
-                        self.seen_pdf_attachment_ids.add(attachment_id)
-                        
+                    if digest:
+                        self._remember_pdf_hash(digest, pdf_filepath)
                         downloaded_pdfs.append(str(pdf_filepath))
-                        logger.info(f"PDF gespeichert: {pdf_filename}")
+                        logger.debug(f"PDF gespeichert: {pdf_filename}")
+                    else:
+                        # Download fehlgeschlagen -> Reservierung wieder freigeben
+                        with self._pdf_lock:
+                            self.seen_pdf_attachment_ids.discard(attachment_id)
                     
                 except Exception as e:
-                    logger.error(f"Fehler beim Herunterladen von PDF-Attachment {attachment.get('name', 'Unbekannt')}: {e}")
+                    logger.error(f"Fehler beim Herunterladen von PDF-Attachment {pdf_filename}: {e}")
+                    with self._pdf_lock:
+                        self.seen_pdf_attachment_ids.discard(attachment_id)
                     continue
             
         except Exception as e:
@@ -646,24 +1040,116 @@ Ordner: {folder_name}
         
         return downloaded_pdfs
     
-    def _download_attachment_content(self, email_id: str, attachment_id: str) -> Optional[bytes]:
-        """Lädt den Inhalt eines Attachments herunter"""
+    def _release_pdf_path(self, pdf_filepath: Path):
+        """Entfernt eine vorhandene PDF-Datei samt Eintrag im Hash-Index"""
+        with self._pdf_lock:
+            digest = self._pdf_hash_by_name.pop(pdf_filepath.name, None)
+            if digest and self._pdf_hash_index.get(digest) == pdf_filepath.name:
+                del self._pdf_hash_index[digest]
+                self._pdf_index_dirty = True
         try:
-            access_token = self.get_access_token()
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
+            pdf_filepath.unlink()
+        except FileNotFoundError:
+            pass
+    
+    def _remember_pdf_hash(self, digest: str, pdf_filepath: Path):
+        """Trägt eine gespeicherte PDF-Datei in den Hash-Index ein"""
+        with self._pdf_lock:
+            self._pdf_hash_index[digest] = pdf_filepath.name
+            self._pdf_hash_by_name[pdf_filepath.name] = digest
+            self._pdf_index_dirty = True
+    
+    def _link_known_pdf(self, digest: str, pdf_filepath: Path) -> bool:
+        """Legt pdf_filepath als Hardlink auf eine bereits gespeicherte Datei mit gleichem SHA-256 an
+        
+        Eine vorhandene Datei unter pdf_filepath (z. B. gerade gestreamt) wird atomar ersetzt.
+        Gibt False zurück, wenn der Inhalt unbekannt ist oder nicht verlinkt werden kann.
+        """
+        with self._pdf_lock:
+            existing_name = self._pdf_hash_index.get(digest)
+        if not existing_name or existing_name == pdf_filepath.name:
+            return False
+        
+        tmp_path = pdf_filepath.with_name(pdf_filepath.name + '.tmp')
+        try:
+            os.link(self.pdf_dir / existing_name, tmp_path)
+            os.replace(tmp_path, pdf_filepath)
+        except OSError:
+            # Quelle gelöscht oder Dateisystem ohne Hardlinks: eigene Kopie behalten
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            return False
+        logger.debug(f"PDF-Inhalt bereits vorhanden, Hardlink auf {existing_name}")
+        return True
+    
+    def _store_pdf_content(self, pdf_content: bytes, pdf_filepath: Path) -> str:
+        """Speichert ein PDF und gibt den SHA-256 zurück; bekannte Inhalte werden nur verlinkt"""
+        digest = hashlib.sha256(pdf_content).hexdigest()
+        if self._link_known_pdf(digest, pdf_filepath):
+            return digest
+        
+        with open(pdf_filepath, 'wb') as f:
+            f.write(pdf_content)
+        return digest
+    
+    def _download_attachments_batch(self, email_id: str, attachment_ids: List[str]) -> Dict[str, bytes]:
+        """Lädt mehrere Attachments einer E-Mail über $batch (bis zu 20 Teilanfragen pro Anfrage)
+        
+        Fehlgeschlagene Teilanfragen fehlen im Ergebnis und werden vom Aufrufer einzeln geladen.
+        """
+        contents = {}
+        for start in range(0, len(attachment_ids), _GRAPH_BATCH_LIMIT):
+            batch_ids = attachment_ids[start:start + _GRAPH_BATCH_LIMIT]
+            batch_request = {
+                'requests': [
+                    {
+                        'id': str(index),
+                        'method': 'GET',
+                        'url': f"/users/{self.email_address}/messages/{email_id}/attachments/{attachment_id}/$value"
+                    }
+                    for index, attachment_id in enumerate(batch_ids)
+                ]
             }
-            
-            # Attachment-Inhalt herunterladen - korrekte URL über E-Mail-ID
+            try:
+                response = self._graph_request('POST', f"{self.graph_endpoint}/$batch", json=batch_request)
+                response.raise_for_status()
+                
+                # Binäre Antworten liefert $batch Base64-kodiert im JSON
+                for sub_response in loads_json(response.content).get('responses', []):
+                    body = sub_response.get('body')
+                    if sub_response.get('status') == 200 and isinstance(body, str):
+                        contents[batch_ids[int(sub_response['id'])]] = base64.b64decode(body)
+                        
+            except Exception as e:
+                logger.error(f"Fehler bei $batch-Anfrage für Attachments: {e}")
+        
+        return contents
+    
+    def _download_attachment_content(self, email_id: str, attachment_id: str, dest_path: Path) -> Optional[str]:
+        """Lädt den Inhalt eines Attachments herunter, streamt ihn blockweise nach dest_path
+        und gibt den SHA-256 des Inhalts zurück (None bei Fehlern)"""
+        try:
+            # Attachment-Inhalt herunterladen - korrekte URL über E-Mail-ID ($value liefert Rohbytes)
             url = f"{self.graph_endpoint}/users/{self.email_address}/messages/{email_id}/attachments/{attachment_id}/$value"
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            sha256 = hashlib.sha256()
+            with self._graph_get(url, stream=True) as response:
+                response.raise_for_status()
+                with open(dest_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        sha256.update(chunk)
+                        f.write(chunk)
             
-            return response.content
+            return sha256.hexdigest()
             
         except Exception as e:
             logger.error(f"Fehler beim Herunterladen des Attachment-Inhalts: {e}")
+            # Unvollständige Datei nicht liegen lassen
+            try:
+                dest_path.unlink()
+            except OSError:
+                pass
             return None
 
 
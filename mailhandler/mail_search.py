@@ -6,25 +6,151 @@ Bereitet E-Mails für LLM-Recherchen vor
 
 import os
 import re
-import json
-from datetime import datetime
+import sys
+import sqlite3
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import logging
 
 from dotenv import load_dotenv
 
+from json_utils import dumps_json, loads_json
+
+# Länge der Inhaltsvorschau, die für LLM-Kontexte vorberechnet wird
+BODY_PREVIEW_LENGTH = 500
+
+# Persistenter Volltext-Index (SQLite FTS5, Trigramme) im E-Mail-Verzeichnis
+SEARCH_INDEX_FILENAME = '.search_index.sqlite'
+# Bei Änderungen an Schema oder Normalisierung erhöhen (erzwingt Neuaufbau)
+_SEARCH_INDEX_VERSION = 3
+# Zwischenspeicher der geparsten E-Mails (JSON, kein Pickle: das E-Mail-Verzeichnis kann
+# von anderen beschreibbar sein, z. B. synchronisiert) im E-Mail-Verzeichnis
+MAIL_INDEX_CACHE_FILENAME = '.mail_index.json'
+# Bei Änderungen am Format der geparsten E-Mails erhöhen (verwirft den Zwischenspeicher)
+_MAIL_INDEX_CACHE_VERSION = 4
+# Felder einer geparsten E-Mail im Zwischenspeicher und ihre Typen (filepath wird neu gesetzt)
+_CACHED_TEXT_FIELDS = ('filename', 'from', 'to', 'subject', 'body', 'body_preview')
+_CACHED_INT_FIELDS = ('body_length', 'word_count')
+# Trigramm-Index findet erst Suchbegriffe ab 3 Zeichen
+_SEARCH_INDEX_MIN_QUERY = 3
+
+# Datumszeile im Mail-Kopf (vorkompiliert, ersetzt strptime im Normalfall): 'YYYY-MM-DD HH:MM:SS'
+# oder receivedDateTime von Graph, wie es der Downloader schreibt ('YYYY-MM-DDTHH:MM:SSZ', UTC)
+_HEADER_DATE = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})[ T]([0-9]{2}):([0-9]{2}):([0-9]{2})Z?')
+
+# Kopfzeilen der gespeicherten E-Mails: Präfix -> Metadatenfeld
+_HEADER_FIELDS = {
+    'Von: ': 'from',
+    'An: ': 'to',
+    'Datum: ': 'received_date',
+    'Betreff: ': 'subject'
+}
+# Nur so viele Zeilen am Dateianfang werden nach Kopfzeilen durchsucht
+_HEADER_MAX_LINES = 10
+
+# Threads für das Einlesen der E-Mail-Dateien (I/O-gebunden, read() gibt den GIL frei)
+_LOAD_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
 # Logging konfigurieren
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _file_fingerprint(stat: os.stat_result) -> List[int]:
+    """Änderungsmerkmal einer Datei: Größe, Änderungszeit und ctime (alle in ns)
+    
+    Die Änderungszeit allein genügt nicht: der Downloader setzt sie auf das Empfangsdatum,
+    eine überschriebene E-Mail behält sie also. ctime ändert sich bei jedem Schreiben.
+    """
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns]
+
+
+def _mail_from_cache_record(record: Any, filename: str, filepath: str) -> Optional[Dict[str, Any]]:
+    """Prüft einen Eintrag aus dem Zwischenspeicher und baut daraus die E-Mail (None, falls ungültig)"""
+    if not isinstance(record, dict) or record.get('filename') != filename:
+        return None
+    if not all(isinstance(record.get(field), str) for field in _CACHED_TEXT_FIELDS):
+        return None
+    if not all(type(record.get(field)) is int for field in _CACHED_INT_FIELDS):
+        return None
+    received_date = record.get('received_date')
+    if not isinstance(received_date, str):
+        return None
+    try:
+        received_date = datetime.fromisoformat(received_date)
+    except ValueError:
+        return None
+    
+    return {
+        'filename': filename,
+        'filepath': filepath,
+        'from': sys.intern(record['from']),
+        'to': sys.intern(record['to']),
+        'received_date': received_date,
+        'subject': record['subject'],
+        'body': record['body'],
+        'body_preview': record['body_preview'],
+        'body_length': record['body_length'],
+        'word_count': record['word_count']
+    }
+
+
+def _parse_header_date(date_str: str) -> datetime:
+    """Parst das Datum aus dem Mail-Kopf, im Normalfall ohne strptime
+    
+    Zeitangaben mit Zone (Graph liefert UTC mit 'Z') werden wie im Dateinamen des Downloaders
+    als UTC ohne tzinfo zurückgegeben, damit sie mit den übrigen (naiven) Daten vergleichbar sind.
+    """
+    match = _HEADER_DATE.fullmatch(date_str)
+    if match:
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            pass
+    # Abweichende Schreibweisen (z. B. einstellige Felder) wie bisher über strptime
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        pass
+    # ISO 8601 mit Sekundenbruchteilen oder Zeitzone (fromisoformat versteht 'Z' erst ab Python 3.11)
+    parsed = datetime.fromisoformat(date_str[:-1] + '+00:00' if date_str.endswith('Z') else date_str)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
 class MailSearch:
     """Klasse für E-Mail-Suche und -Vorbereitung"""
     
     def __init__(self, mail_dir: str = "mails"):
         self.mail_dir = Path(mail_dir)
         self.mail_index = []
+        # Aufsteigend sortierte Empfangsdaten (Spiegel von mail_index) für Bereichsabfragen
+        self._dates_ascending = []
+        self._dates_for = None
+        
+        # Normalisierte (casefold) Suchfelder (Betreff, Absender, Inhalt) parallel zu mail_index,
+        # damit nicht bei jeder Suche alle Texte erneut umgewandelt werden
+        self._search_fields = []
+        self._search_fields_for = None
+        
+        # Volltext-Index: Verbindung und Zuordnung Index-Zeile -> Position in mail_index
+        self._search_db = None
+        self._search_positions = {}
+        self._search_indexed = None
+        # Index, für den der Abgleich zuletzt versucht wurde (erst bei der ersten Suche)
+        self._search_synced_for = None
+        
+        # Kennzahlen für create_summary, einmal je geladenem Index berechnet
+        self._summary = None
+        self._summary_for = None
         
         if not self.mail_dir.exists():
             raise ValueError(f"E-Mail-Verzeichnis {mail_dir} existiert nicht")
@@ -34,47 +160,289 @@ class MailSearch:
         logger.info(f"Lade E-Mail-Index aus {self.mail_dir}")
         
         mail_files = list(self.mail_dir.glob("*.txt"))
-        index = []
         
-        for mail_file in mail_files:
+        # Unveränderte Dateien (gleiches Änderungsmerkmal) aus dem Zwischenspeicher übernehmen
+        cached = self._load_mail_index_cache()
+        entries = {}
+        parsed = [None] * len(mail_files)
+        to_parse = []
+        for i, file_path in enumerate(mail_files):
             try:
-                mail_data = self._parse_mail_file(mail_file)
-                if mail_data:
-                    index.append(mail_data)
-            except Exception as e:
-                logger.error(f"Fehler beim Parsen von {mail_file}: {e}")
+                stat = file_path.stat()
+            except OSError:
+                to_parse.append(i)
                 continue
+            fingerprint = _file_fingerprint(stat)
+            entry = cached.get(file_path.name)
+            mail_data = None
+            if entry is not None and entry[0] == fingerprint:
+                mail_data = _mail_from_cache_record(entry[1], file_path.name, str(file_path))
+            if mail_data is not None:
+                parsed[i] = mail_data
+                entries[file_path.name] = (fingerprint, mail_data)
+            else:
+                to_parse.append(i)
+                entries[file_path.name] = (fingerprint, None)
+        
+        # Neue/geänderte Dateien parallel einlesen (Reihenfolge bleibt erhalten)
+        cache_changed = False
+        if to_parse:
+            now = datetime.now()
+            with ThreadPoolExecutor(max_workers=_LOAD_WORKERS) as executor:
+                for i, mail_data in zip(to_parse, executor.map(self._parse_mail_file_safe,
+                                                               [mail_files[i] for i in to_parse])):
+                    parsed[i] = mail_data
+                    if not mail_data:
+                        continue
+                    if mail_data['received_date'] is None:
+                        # Ohne gültiges Datum: Ersatzwert nur im Speicher, nicht zwischenspeichern
+                        # (sonst bliebe der Zeitpunkt des ersten Einlesens dauerhaft stehen)
+                        mail_data['received_date'] = now
+                        continue
+                    name = mail_files[i].name
+                    if name in entries:
+                        entries[name] = (entries[name][0], mail_data)
+                        cache_changed = True
+        
+        index = [mail_data for mail_data in parsed if mail_data]
+        
+        entries = {name: entry for name, entry in entries.items() if entry[1] is not None}
+        if cache_changed or len(entries) != len(cached):
+            self._save_mail_index_cache(entries)
+        logger.info(f"{len(to_parse)} E-Mail-Dateien neu eingelesen, {len(mail_files) - len(to_parse)} aus dem Zwischenspeicher")
         
         # Nach Datum sortieren (neueste zuerst)
         index.sort(key=lambda x: x['received_date'], reverse=True)
         
         self.mail_index = index
+        self._dates_ascending = [mail['received_date'] for mail in reversed(index)]
+        self._dates_for = index
         logger.info(f"Index erstellt: {len(index)} E-Mails")
         return index
     
+    def _dates_match_index(self) -> bool:
+        """Prüft, ob der sortierte Datumsspiegel zum aktuellen mail_index gehört"""
+        return (self._dates_for is self.mail_index and bool(self.mail_index)
+                and len(self._dates_ascending) == len(self.mail_index))
+    
+    def _get_summary(self) -> Dict[str, Any]:
+        """Liefert die Kennzahlen des Index (neu berechnet, wenn sich mail_index geändert hat)"""
+        index = self.mail_index
+        if self._summary_for is index and self._summary['total_emails'] == len(index):
+            return self._summary
+        
+        total_emails = len(index)
+        total_words = sum(mail['word_count'] for mail in index)
+        
+        # Datumsbereich: Enden des sortierten Datumsspiegels, sonst min/max
+        if self._dates_match_index():
+            earliest_date = self._dates_ascending[0]
+            latest_date = self._dates_ascending[-1]
+        else:
+            dates = [mail['received_date'] for mail in index]
+            earliest_date = min(dates) if dates else None
+            latest_date = max(dates) if dates else None
+        
+        # Häufigste Absender
+        senders = Counter(mail['from'] for mail in index)
+        
+        self._summary = {
+            'total_emails': total_emails,
+            'total_words': total_words,
+            'average_words_per_email': total_words / total_emails if total_emails > 0 else 0,
+            'date_range': {
+                'earliest': earliest_date.isoformat() if earliest_date else None,
+                'latest': latest_date.isoformat() if latest_date else None
+            },
+            'top_senders': senders.most_common(5)
+        }
+        self._summary_for = index
+        return self._summary
+    
+    def _load_mail_index_cache(self) -> Dict[str, tuple]:
+        """Lädt den Zwischenspeicher: Dateiname -> (Änderungsmerkmal, ungeprüfter Eintrag)
+        
+        Die Einträge werden erst bei der Verwendung über _mail_from_cache_record geprüft.
+        """
+        cache_path = self.mail_dir / MAIL_INDEX_CACHE_FILENAME
+        if not cache_path.exists():
+            return {}
+        try:
+            with open(cache_path, 'rb') as f:
+                cache = loads_json(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Zwischenspeicher {cache_path} nicht lesbar, lese alle E-Mails neu ein: {e}")
+            return {}
+        
+        if (not isinstance(cache, dict) or cache.get('version') != _MAIL_INDEX_CACHE_VERSION
+                or not isinstance(cache.get('entries'), dict)):
+            return {}
+        
+        entries = {}
+        for filename, entry in cache['entries'].items():
+            # Eintrag: [Größe, Änderungszeit (ns), ctime (ns), E-Mail]
+            if (isinstance(entry, list) and len(entry) == 4
+                    and all(type(value) is int for value in entry[:3])):
+                entries[filename] = (entry[:3], entry[3])
+        return entries
+    
+    def _save_mail_index_cache(self, entries: Dict[str, tuple]):
+        """Schreibt den Zwischenspeicher als JSON (atomar über eine temporäre Datei)"""
+        cache_path = self.mail_dir / MAIL_INDEX_CACHE_FILENAME
+        tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+        cache = {
+            'version': _MAIL_INDEX_CACHE_VERSION,
+            'entries': {
+                filename: [*fingerprint, {key: value for key, value in mail_data.items() if key != 'filepath'}]
+                for filename, (fingerprint, mail_data) in entries.items()
+            }
+        }
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(dumps_json(cache))
+            os.replace(tmp_path, cache_path)
+        except (OSError, TypeError) as e:
+            logger.warning(f"Zwischenspeicher {cache_path} konnte nicht geschrieben werden: {e}")
+    
+    def _get_search_fields(self) -> List[tuple]:
+        """Liefert die normalisierten Suchfelder je E-Mail (neu berechnet, wenn sich mail_index geändert hat)"""
+        if self._search_fields_for is not self.mail_index or len(self._search_fields) != len(self.mail_index):
+            # casefold statt lower, damit z. B. 'Straße' und 'STRASSE' zueinander passen
+            self._search_fields = [(mail['subject'].casefold(), mail['from'].casefold(), mail['body'].casefold())
+                                   for mail in self.mail_index]
+            self._search_fields_for = self.mail_index
+        return self._search_fields
+    
+    def _open_search_index(self) -> Optional[sqlite3.Connection]:
+        """Öffnet den Volltext-Index (None, falls SQLite ohne FTS5/Trigramme oder nicht beschreibbar)"""
+        db_path = self.mail_dir / SEARCH_INDEX_FILENAME
+        try:
+            db = sqlite3.connect(str(db_path), check_same_thread=False)
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != str(_SEARCH_INDEX_VERSION):
+                # Neu anlegen (erster Lauf oder geänderte Index-Version)
+                db.execute("DROP TABLE IF EXISTS files")
+                db.execute("DROP TABLE IF EXISTS mails")
+                db.execute("CREATE TABLE files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, "
+                           "size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER)")
+                # Felder werden normalisiert (casefold) gespeichert, damit ein Treffer exakt
+                # 'suchbegriff.casefold() in feld.casefold()' entspricht
+                db.execute("CREATE VIRTUAL TABLE mails USING fts5(subject, sender, body, "
+                           "tokenize='trigram case_sensitive 1')")
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(_SEARCH_INDEX_VERSION),))
+                db.commit()
+            return db
+        except sqlite3.Error as e:
+            logger.warning(f"Volltext-Index nicht verfügbar, verwende lineare Suche: {e}")
+            return None
+    
+    def _sync_search_index(self, search_fields: List[tuple]):
+        """Gleicht den Volltext-Index mit den geladenen E-Mails ab (nur neue/geänderte Dateien werden indiziert)"""
+        index = self.mail_index
+        self._search_synced_for = index
+        if self._search_db is None:
+            self._search_db = self._open_search_index()
+        if self._search_db is None:
+            return
+        
+        db = self._search_db
+        try:
+            indexed = {filename: (row_id, [size, mtime_ns, ctime_ns])
+                       for row_id, filename, size, mtime_ns, ctime_ns
+                       in db.execute("SELECT id, filename, size, mtime_ns, ctime_ns FROM files")}
+            positions = {}
+            new_rows = []
+            
+            with db:
+                for position, mail in enumerate(index):
+                    fingerprint = _file_fingerprint(os.stat(mail['filepath']))
+                    entry = indexed.pop(mail['filename'], None)
+                    if entry is not None:
+                        row_id, indexed_fingerprint = entry
+                        if indexed_fingerprint == fingerprint:
+                            positions[row_id] = position
+                            continue
+                        # Datei geändert: alten Eintrag ersetzen
+                        db.execute("DELETE FROM mails WHERE rowid = ?", (row_id,))
+                        db.execute("DELETE FROM files WHERE id = ?", (row_id,))
+                    
+                    row_id = db.execute("INSERT INTO files (filename, size, mtime_ns, ctime_ns) VALUES (?, ?, ?, ?)",
+                                        (mail['filename'], *fingerprint)).lastrowid
+                    new_rows.append((row_id, *search_fields[position]))
+                    positions[row_id] = position
+                
+                db.executemany("INSERT INTO mails (rowid, subject, sender, body) VALUES (?, ?, ?, ?)", new_rows)
+                
+                # Gelöschte Dateien aus dem Index entfernen
+                stale_ids = [(row_id,) for row_id, _ in indexed.values()]
+                db.executemany("DELETE FROM mails WHERE rowid = ?", stale_ids)
+                db.executemany("DELETE FROM files WHERE id = ?", stale_ids)
+            
+            self._search_positions = positions
+            self._search_indexed = index
+            if new_rows or stale_ids:
+                logger.info(f"Volltext-Index aktualisiert: {len(new_rows)} neu, {len(stale_ids)} entfernt")
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Volltext-Index konnte nicht aktualisiert werden, verwende lineare Suche: {e}")
+            self._search_positions = {}
+            self._search_indexed = None
+    
+    def _search_candidates(self, query_folded: str) -> Optional[List[int]]:
+        """Liefert die Positionen der E-Mails, die den Suchbegriff enthalten können (None = alle prüfen)"""
+        if (self._search_indexed is None or self._search_indexed is not self.mail_index
+                or len(query_folded) < _SEARCH_INDEX_MIN_QUERY):
+            return None
+        
+        # Suchbegriff als Phrase: Trigramm-Phrasen entsprechen einer Teilstring-Suche
+        phrase = '"' + query_folded.replace('"', '""') + '"'
+        try:
+            rows = self._search_db.execute("SELECT rowid FROM mails WHERE mails MATCH ?", (phrase,)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Volltext-Suche fehlgeschlagen, verwende lineare Suche: {e}")
+            return None
+        
+        # In Index-Reihenfolge (neueste zuerst) zurückgeben
+        return sorted(self._search_positions[row_id] for (row_id,) in rows if row_id in self._search_positions)
+    
+    def _parse_mail_file_safe(self, filepath: Path) -> Optional[Dict[str, Any]]:
+        """Parst eine E-Mail-Datei und protokolliert Fehler, statt sie weiterzureichen"""
+        try:
+            return self._parse_mail_file(filepath)
+        except Exception as e:
+            logger.error(f"Fehler beim Parsen von {filepath}: {e}")
+            return None
+    
     def _parse_mail_file(self, filepath: Path) -> Dict[str, Any]:
         """Parst eine E-Mail-Datei und extrahiert Metadaten"""
         with open(filepath, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        # Metadaten extrahieren
+        # Metadaten extrahieren (nur die ersten Zeilen, ohne die ganze Datei in Zeilen zu zerlegen)
         metadata = {}
-        lines = content.split('\n')
-        
-        for line in lines[:10]:  # Nur die ersten 10 Zeilen für Metadaten
-            if line.startswith('Von: '):
-                metadata['from'] = line[5:].strip()
-            elif line.startswith('An: '):
-                metadata['to'] = line[4:].strip()
-            elif line.startswith('Datum: '):
-                date_str = line[7:].strip()
+        pos = 0
+        
+        for _ in range(_HEADER_MAX_LINES):
+            line_end = content.find('\n', pos)
+            line = content[pos:] if line_end == -1 else content[pos:line_end]
+            
+            separator = line.find(': ')
+            field = _HEADER_FIELDS.get(line[:separator + 2]) if separator != -1 else None
+            if field == 'received_date':
                 try:
-                    metadata['received_date'] = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                except:
-                    metadata['received_date'] = datetime.now()
-            elif line.startswith('Betreff: '):
-                metadata['subject'] = line[9:].strip()
+                    metadata['received_date'] = _parse_header_date(line[separator + 2:].strip())
+                except ValueError:
+                    logger.debug(f"Ungültiges Datum in {filepath.name}: {line[separator + 2:].strip()}")
+            elif field == 'subject':
+                metadata['subject'] = line[separator + 2:].strip()
                 break
+            elif field:
+                # Absender/Empfänger wiederholen sich: eine gemeinsame Kopie je Adresse (auch für Counter)
+                metadata[field] = sys.intern(line[separator + 2:].strip())
+            
+            if line_end == -1:
+                break
+            pos = line_end + 1
         
         # Inhalt extrahieren (alles nach den Metadaten)
         content_start = content.find('\n\n')
@@ -88,9 +456,11 @@ class MailSearch:
             'filepath': str(filepath),
             'from': metadata.get('from', 'Unbekannt'),
             'to': metadata.get('to', 'Unbekannt'),
-            'received_date': metadata.get('received_date', datetime.now()),
+            # None, falls kein gültiges Datum: load_mail_index setzt einen Ersatzwert
+            'received_date': metadata.get('received_date'),
             'subject': metadata.get('subject', 'Kein Betreff'),
             'body': body,
+            'body_preview': body[:BODY_PREVIEW_LENGTH],
             'body_length': len(body),
             'word_count': len(body.split())
         }
@@ -100,71 +470,99 @@ class MailSearch:
         if not self.mail_index:
             self.load_mail_index()
         
-        query_lower = query.lower()
+        query_folded = query.casefold()
         results = []
         
-        for mail in self.mail_index:
+        # Vorauswahl über den Volltext-Index, Bewertung wie bisher über die Teilstring-Prüfung
+        # (Suchfelder und Volltext-Index werden erst bei der ersten Suche je Index aufgebaut)
+        search_fields = self._get_search_fields()
+        if len(query_folded) >= _SEARCH_INDEX_MIN_QUERY and self._search_synced_for is not self.mail_index:
+            self._sync_search_index(search_fields)
+        positions = self._search_candidates(query_folded)
+        if positions is None:
+            positions = range(len(self.mail_index))
+        
+        for position in positions:
+            subject_folded, from_folded, body_folded = search_fields[position]
             score = 0
             
             # Suche in Betreff
-            if query_lower in mail['subject'].lower():
+            if query_folded in subject_folded:
                 score += 10
             
             # Suche im Absender
-            if query_lower in mail['from'].lower():
+            if query_folded in from_folded:
                 score += 5
             
             # Suche im Inhalt
-            if query_lower in mail['body'].lower():
+            if query_folded in body_folded:
                 score += 1
             
             if score > 0:
-                mail_copy = mail.copy()
-                mail_copy['search_score'] = score
-                results.append(mail_copy)
+                results.append((score, position))
         
-        # Nach Relevanz sortieren
-        results.sort(key=lambda x: x['search_score'], reverse=True)
+        # Nur die besten Treffer nach Relevanz sortieren (bei Gleichstand bleibt die Reihenfolge erhalten)
+        # und nur diese kopieren
+        top_results = []
+        for score, position in heapq.nlargest(max_results, results, key=itemgetter(0)):
+            mail_copy = self.mail_index[position].copy()
+            mail_copy['search_score'] = score
+            top_results.append(mail_copy)
         
-        return results[:max_results]
+        return top_results
     
     def get_emails_by_date_range(self, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
         """Holt E-Mails aus einem bestimmten Zeitraum"""
         if not self.mail_index:
             self.load_mail_index()
         
-        results = []
-        for mail in self.mail_index:
-            if start_date <= mail['received_date'] <= end_date:
-                results.append(mail)
+        if not self._dates_match_index():
+            # Index wurde außerhalb von load_mail_index gesetzt
+            return [mail for mail in self.mail_index
+                    if start_date <= mail['received_date'] <= end_date]
+        
+        # Der Index ist absteigend sortiert: Bereich per Binärsuche im
+        # aufsteigenden Datumsspiegel bestimmen und auf den Index abbilden
+        count = len(self._dates_ascending)
+        lower = bisect_left(self._dates_ascending, start_date)
+        upper = bisect_right(self._dates_ascending, end_date)
+        if lower >= upper:
+            return []
+        results = self.mail_index[count - upper:count - lower]
         
         return results
     
     def export_for_llm(self, output_file: str = "emails_for_llm.json", 
-                      max_emails: int = 100) -> str:
-        """Exportiert E-Mails in einem LLM-freundlichen Format"""
+                      max_emails: int = 100, pretty: bool = False) -> str:
+        """Exportiert E-Mails in einem LLM-freundlichen Format (kompaktes JSON, mit pretty eingerückt)"""
         if not self.mail_index:
             self.load_mail_index()
         
-        # E-Mails für LLM vorbereiten
-        llm_data = []
-        
-        for mail in self.mail_index[:max_emails]:
-            llm_entry = {
-                'id': mail['filename'],
-                'date': mail['received_date'].isoformat(),
-                'from': mail['from'],
-                'subject': mail['subject'],
-                'content': mail['body'],
-                'word_count': mail['word_count']
-            }
-            llm_data.append(llm_entry)
-        
-        # Als JSON speichern
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(llm_data, f, ensure_ascii=False, indent=2)
+        # E-Mails einzeln als JSON-Array schreiben, ohne die Exportdaten vorher zu sammeln
+        count = 0
+        with open(output_file, 'wb') as f:
+            f.write(b'[')
+            for mail in islice(self.mail_index, max_emails):
+                llm_entry = {
+                    'id': mail['filename'],
+                    'date': mail['received_date'],
+                    'from': mail['from'],
+                    'subject': mail['subject'],
+                    'content': mail['body'],
+                    'word_count': mail['word_count']
+                }
+                if pretty:
+                    f.write(b',\n  ' if count else b'\n  ')
+                    # Datensatz um eine Ebene einrücken (Zeilenumbrüche in Texten sind als \n maskiert)
+                    f.write(dumps_json(llm_entry, pretty=True).replace(b'\n', b'\n  '))
+                else:
+                    if count:
+                        f.write(b',')
+                    f.write(dumps_json(llm_entry))
+                count += 1
+            f.write(b'\n]' if pretty and count else b']')
         
-        logger.info(f"LLM-Export erstellt: {output_file} ({len(llm_data)} E-Mails)")
+        logger.info(f"LLM-Export erstellt: {output_file} ({count} E-Mails)")
         return output_file
     
     def create_summary(self) -> Dict[str, Any]:
@@ -175,32 +573,9 @@ class MailSearch:
         if not self.mail_index:
             return {}
         
-        total_emails = len(self.mail_index)
-        total_words = sum(mail['word_count'] for mail in self.mail_index)
-        
-        # Datumsbereich
-        dates = [mail['received_date'] for mail in self.mail_index]
-        earliest_date = min(dates)
-        latest_date = max(dates)
-        
-        # Häufigste Absender
-        senders = {}
-        for mail in self.mail_index:
-            sender = mail['from']
-            senders[sender] = senders.get(sender, 0) + 1
-        
-        top_senders = sorted(senders.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        return {
-            'total_emails': total_emails,
-            'total_words': total_words,
-            'average_words_per_email': total_words / total_emails if total_emails > 0 else 0,
-            'date_range': {
-                'earliest': earliest_date.isoformat(),
-                'latest': latest_date.isoformat()
-            },
-            'top_senders': top_senders
-        }
+        # Zwischengespeicherte Kennzahlen als Kopie zurückgeben
+        summary = self._get_summary()
+        return dict(summary, date_range=dict(summary['date_range']), top_senders=list(summary['top_senders']))
 
 
 def main():
@@ -211,6 +586,7 @@ def main():
     parser.add_argument('--mail-dir', default='mails', help='E-Mail-Verzeichnis')
     parser.add_argument('--search', help='Suchbegriff')
     parser.add_argument('--export', action='store_true', help='Export für LLM erstellen')
+    parser.add_argument('--pretty', action='store_true', help='LLM-Export eingerückt formatieren (zur Kontrolle)')
     parser.add_argument('--summary', action='store_true', help='Zusammenfassung anzeigen')
     parser.add_argument('--max-results', type=int, default=10, help='Maximale Anzahl Ergebnisse')
     
@@ -235,7 +611,7 @@ def main():
                 print("❌ Keine E-Mails gefunden")
         
         elif args.export:
-            output_file = mail_search.export_for_llm()
+            output_file = mail_search.export_for_llm(pretty=args.pretty)
             print(f"✅ LLM-Export erstellt: {output_file}")
         
         elif args.summary: